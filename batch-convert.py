@@ -1,44 +1,333 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 from PIL import Image
 
+from imagepalette import checkArgs, createParser, processImage, setupLogging
+from modules.journal import Journal, fingerprint
+from modules.palette_cache import PaletteCache
 from modules.palette_extractor import PaletteExtractor
 
+# arguments that do not change the output of a photo, left out of the journal
+JOURNAL_IGNORED = {
+    "inputs",
+    "input",
+    "pattern",
+    "workers",
+    "background_save",
+    "journal",
+    "force",
+    "console",
+    "cache",
+    "cache_dir",
+    "cache_size",
+    "clear_cache",
+    "metrics",
+    "trace_memory",
+}
 
-def main():
-    path = Path(".").glob("*.jpg")
-    photos = [str(x) for x in path if x.is_file()]
-
-    print(f"Starting extraction of {len(photos)} photos")
-    i = 0
-    for photo in photos:
-        im = Image.open(photo)
-        width, height = im.size
-
-        p = PaletteExtractor()
-        p.loadImage(photo, resize=True)
-        p.extractColors(min_dist=25, seed=42)
-
-        if width > height:
-            # horizontal image
-            p.incorporatePalette(
-                output_scl=0.9,
-                color_height_scl=0.75,
-                color_width_scl=0.9,
-                position="r",
-            )
+# thread of each worker process encoding the images in the background,
+# the queue receiving the path and the error (or None) of each saved photo
+# and the future of the last photo sent to the queue
+_encoder: ThreadPoolExecutor = None
+_saved: multiprocessing.Queue = None
+_last_saved: Future = None
+
+
+def initWorker(saved: multiprocessing.Queue):
+    """Start the encoding thread of a worker process.
+
+    Args:
+        saved (multiprocessing.Queue): Queue receiving the saved photos.
+    """
+    global _encoder, _saved
+    _encoder = ThreadPoolExecutor(max_workers=1)
+    _saved = saved
+
+
+def reportSaved(photo: str, p: PaletteExtractor):
+    """Wait until the images of a photo are written and send the result.
+
+    Args:
+        photo (str): Path to the photo.
+        p (PaletteExtractor): Extractor of the photo.
+    """
+    try:
+        p.waitSaved()
+    except Exception as e:
+        _saved.put((photo, repr(e)))
+    else:
+        _saved.put((photo, None))
+
+
+def convertPhoto(args: argparse.Namespace, photo: str, folder: str = "") -> dict:
+    """Extract the palette of a photo, run in a worker process.
+
+    With --background-save the images are encoded by the thread \
+        of the worker, while the palette of the next photo is extracted, \
+        and the photo is sent to the queue once they are written.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        photo (str): Path to the photo.
+        folder (str, optional): Folder of the outputs, inside the output folder. \
+            Defaults to "".
+
+    Returns:
+        dict: Fingerprint of the photo before it was converted (if --journal \
+            is set), paths of the outputs and whether the KMeans fit was \
+            truncated by --max-total-iterations or --max-time.
+    """
+    global _last_saved
+
+    # fingerprint the photo before reading it, so that a change during the
+    # conversion is detected by the next run
+    file = fingerprint(photo) if args.journal else None
+    args = argparse.Namespace(**vars(args))
+    if folder:
+        args.output = os.path.join(args.output, folder, "")
+    if args.position is None:
+        # place the palette along the shortest side of the photo
+        width, height = Image.open(photo).size
+        args.position = "r" if width > height else "b"
+
+    if not args.background_save:
+        p = processImage(args, photo)
+    else:
+        p = processImage(args, photo, executor=_encoder)
+        # keep the images of at most two photos in memory
+        if _last_saved is not None:
+            _last_saved.result()
+        _last_saved = _encoder.submit(reportSaved, photo, p)
+
+    return {"file": file, "outputs": p.outputs, "truncated": p.truncated}
+
+
+def findPhotos(
+    inputs: list[str], patterns: list[str], exclude: str = None
+) -> dict[str, str]:
+    """Find the photos matching a list of paths, glob patterns or directories.
+
+    The directories are searched recursively for the files matching \
+        any of the patterns. The outputs of the photos mirror their tree \
+        below the directory, or below the folders of a glob pattern \
+        that precede the first wildcard.
+
+    Args:
+        inputs (list[str]): Paths, glob patterns (** matches any folder) \
+            or directories.
+        patterns (list[str]): Glob patterns of the photos in the directories.
+        exclude (str, optional): Folder whose files are ignored, \
+            such as the output folder. Defaults to None.
+
+    Returns:
+        dict[str, str]: Folder of the outputs of each photo, relative to \
+            the output folder, sorted by path.
+    """
+    photos = {}
+    for path in inputs:
+        if os.path.isdir(path):
+            for pattern in patterns:
+                for x in Path(path).rglob(pattern):
+                    if x.is_file():
+                        photos.setdefault(
+                            os.path.normpath(x), str(x.parent.relative_to(path))
+                        )
         else:
-            # vertical image
-            p.incorporatePalette(
-                output_scl=0.9,
-                color_height_scl=0.9,
-                color_width_scl=0.75,
-                position="b",
+            # folders of the pattern before the first wildcard
+            parts = Path(path).parts
+            fixed = next(
+                (i for i, part in enumerate(parts) if glob.has_magic(part)),
+                len(parts) - 1,
             )
+            base = Path(*parts[:fixed]) if fixed else Path(".")
+            for x in glob.glob(path, recursive=True):
+                if os.path.isfile(x):
+                    photos.setdefault(
+                        os.path.normpath(x), os.path.relpath(Path(x).parent, base)
+                    )
+
+    if exclude is not None:
+        exclude = Path(exclude).resolve()
+        photos = {
+            photo: folder
+            for photo, folder in photos.items()
+            if exclude not in Path(photo).resolve().parents
+        }
+
+    return {
+        photo: "" if folder == "." else folder
+        for photo, folder in sorted(photos.items())
+    }
+
+
+def findCollisions(folders: dict[str, str]) -> list[list[str]]:
+    """Find the photos whose outputs would be saved to the same files.
+
+    The outputs are named after the file name of the photo \
+        up to its first dot.
+
+    Args:
+        folders (dict[str, str]): Folder of the outputs of each photo, \
+            as returned by findPhotos.
+
+    Returns:
+        list[list[str]]: Groups of photos sharing their outputs.
+    """
+    outputs = {}
+    for photo, folder in folders.items():
+        name = os.path.basename(photo).split(".")[0]
+        outputs.setdefault((folder, name), []).append(photo)
+    return [photos for photos in outputs.values() if len(photos) > 1]
+
+
+def main():
+    parser = createParser(
+        description="Extract the color palette of many images in parallel"
+    )
+    parser.add_argument(
+        "inputs",
+        help="Paths, glob patterns (** matches any folder) or directories of the "
+        "images. Default: *.jpg",
+        nargs="*",
+        default=["*.jpg"],
+    )
+    parser.add_argument(
+        "--pattern",
+        help="Glob patterns of the images searched in the directories and their "
+        "subdirectories. Default: *.jpg",
+        nargs="+",
+        default=["*.jpg"],
+    )
+    parser.add_argument(
+        "--journal",
+        help="JSON-lines file recording each converted image. The images that "
+        "have not changed since their last conversion with the same arguments "
+        "are skipped, so an interrupted run resumes where it stopped",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--force",
+        help="Convert all the images, even if the journal records them as done",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of images processed in parallel. Default: number of cores",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--background-save",
+        help="Encode the images of each photo in the background while the "
+        "palette of the next one is extracted. Faster if there are more cores "
+        "than workers",
+        action="store_true",
+    )
+    # by default, incorporate the palette along the shortest side of the photo
+    parser.set_defaults(
+        output="Edited/",
+        resize=True,
+        seed=42,
+        min_color_distance=25,
+        incorporated=True,
+        position=None,
+    )
+    args = parser.parse_args()
+    if args.clear_cache:
+        PaletteCache(folder=args.cache_dir).clear()
+
+    checkArgs(parser, args)
+    setupLogging(args, __file__.replace(".py", ".log"))
+
+    folders = findPhotos(
+        args.inputs + ([args.input] if args.input else []),
+        args.pattern,
+        exclude=args.output,
+    )
+    collisions = findCollisions(folders)
+    if collisions:
+        parser.error(
+            "Some photos would overwrite the outputs of each other: "
+            + "; ".join(", ".join(photos) for photos in collisions)
+        )
+    photos = list(folders)
+
+    journal = None
+    if args.journal:
+        journal = Journal(args.journal)
+        params = {k: v for k, v in vars(args).items() if k not in JOURNAL_IGNORED}
+        if not args.force:
+            photos = [photo for photo in photos if not journal.isDone(photo, params)]
+            if len(photos) < len(folders):
+                print(f"Skipping {len(folders) - len(photos)} unchanged photos")
+
+    print(f"Starting extraction of {len(photos)} photos on {args.workers} workers")
+
+    start = time.perf_counter()
+    failed = []
+    truncated = []
+    saved = multiprocessing.Queue()
+    # errors of the images saved in the background, by photo
+    save_errors = {}
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=initWorker, initargs=(saved,)
+    ) as executor:
+        futures = [
+            executor.submit(convertPhoto, args, photo, folders[photo])
+            for photo in photos
+        ]
+        # report the progress in the same order as the photos
+        for i, (photo, future) in enumerate(zip(photos, futures)):
+            result = {}
+            try:
+                result = future.result()
+                if result["truncated"]:
+                    truncated.append(photo)
+            except Exception as e:
+                error = repr(e)
+            else:
+                error = None
+                if args.background_save:
+                    while photo not in save_errors:
+                        saved_photo, save_error = saved.get()
+                        save_errors[saved_photo] = save_error
+                    error = save_errors.pop(photo)
+
+            if journal is not None:
+                journal.record(
+                    photo,
+                    params,
+                    result.get("file"),
+                    result.get("outputs"),
+                    error=error,
+                    truncated=result.get("truncated", False),
+                )
+
+            if error is None:
+                note = " (truncated)" if result["truncated"] else ""
+                print(f"{photo} done{note}. {i+1}/{len(photos)}.")
+            else:
+                failed.append(photo)
+                print(f"{photo} failed: {error}. {i+1}/{len(photos)}.")
 
-        p.saveIncorporatedPalette(folder="Edited/")
-        print(f"{photo} done. {i+1}/{len(photos)}.")
-        i += 1
+    elapsed = time.perf_counter() - start
+    converted = len(photos) - len(failed)
+    print(
+        f"Converted {converted}/{len(photos)} photos in {elapsed:.2f}s "
+        f"({converted / elapsed if elapsed else 0:.2f} photos/s)."
+    )
+    if truncated:
+        print(f"Truncated palettes: {len(truncated)}.")
+    if failed:
+        print("Failed photos: " + ", ".join(failed))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,448 @@
+"""Benchmark the phases of the palette extraction on synthetic images."""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+from modules.palette_extractor import PaletteExtractor
+from modules.position import Position
+
+# command line interface whose start-up time is measured
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "imagepalette.py")
+
+
+def gradient_image(width: int, height: int, rng: np.random.Generator) -> Image.Image:
+    """Create an image with a smooth gradient between random colors.
+
+    Args:
+        width (int)
+        height (int)
+        rng (np.random.Generator)
+
+    Returns:
+        Image.Image
+    """
+    corners = rng.integers(0, 256, size=(2, 2, 3)).astype(np.float32)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    top = corners[0, 0] * (1 - x) + corners[0, 1] * x
+    bottom = corners[1, 0] * (1 - x) + corners[1, 1] * x
+    return Image.fromarray((top * (1 - y) + bottom * y).astype(np.uint8))
+
+
+def noise_image(width: int, height: int, rng: np.random.Generator) -> Image.Image:
+    """Create an image of uniform random noise, the worst case for clustering.
+
+    Args:
+        width (int)
+        height (int)
+        rng (np.random.Generator)
+
+    Returns:
+        Image.Image
+    """
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def flat_image(width: int, height: int, rng: np.random.Generator) -> Image.Image:
+    """Create an image made of a few flat color rectangles, like digital artwork.
+
+    Args:
+        width (int)
+        height (int)
+        rng (np.random.Generator)
+
+    Returns:
+        Image.Image
+    """
+    palette = [tuple(c) for c in rng.integers(0, 256, size=(8, 3)).tolist()]
+    image = Image.new("RGB", (width, height), palette[0])
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x_0, x_1 = sorted(rng.integers(0, width, size=2).tolist())
+        y_0, y_1 = sorted(rng.integers(0, height, size=2).tolist())
+        fill = palette[rng.integers(len(palette))]
+        draw.rectangle([x_0, y_0, x_1, y_1], fill=fill)
+    return image
+
+
+def photo_image(width: int, height: int, rng: np.random.Generator) -> Image.Image:
+    """Create a photo-like image: smooth blobs of color with some grain.
+
+    Args:
+        width (int)
+        height (int)
+        rng (np.random.Generator)
+
+    Returns:
+        Image.Image
+    """
+    small = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8))
+    base = np.asarray(small.resize((width, height), Image.Resampling.BICUBIC))
+    grain = rng.normal(0, 8, size=(height, width, 3))
+    return Image.fromarray(np.clip(base + grain, 0, 255).astype(np.uint8))
+
+
+IMAGES = {
+    "gradient": gradient_image,
+    "noise": noise_image,
+    "flat": flat_image,
+    "photo": photo_image,
+}
+
+
+def measure(function, repeat: int) -> list[float]:
+    """Time a function.
+
+    Args:
+        function (Callable): Function to time, without arguments.
+        repeat (int): Number of runs.
+
+    Returns:
+        list[float]: Wall time of each run, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def record(image: str, size: tuple, phase: str, params: dict, times: list) -> dict:
+    """Create a benchmark record.
+
+    Args:
+        image (str): Kind of synthetic image.
+        size (tuple): Size of the image.
+        phase (str): Benchmarked method.
+        params (dict): Parameters of the method.
+        times (list): Wall times of the runs.
+
+    Returns:
+        dict
+    """
+    result = {
+        "image": image,
+        "size": list(size),
+        "phase": phase,
+        "params": params,
+        "times": times,
+        "best": min(times),
+        "median": statistics.median(times),
+    }
+    print(
+        f"{image:>8} {size[0]:>5}x{size[1]:<5} {phase:<24} "
+        f"{json.dumps(params, sort_keys=True):<60} {result['best']:.4f}s"
+    )
+    return result
+
+
+def benchmark_image(
+    args: argparse.Namespace, name: str, path: str, size: tuple, folder: str
+) -> list[dict]:
+    """Benchmark all the phases on a single image.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        name (str): Kind of synthetic image.
+        path (str): Path to the image.
+        size (tuple): Size of the image.
+        folder (str): Output folder of the saved files.
+
+    Returns:
+        list[dict]: Benchmark records.
+    """
+    results = []
+    p = PaletteExtractor()
+
+    for resize in (False, True):
+        times = measure(lambda: p.loadImage(path, resize=resize), args.repeat)
+        results.append(record(name, size, "loadImage", {"resize": resize}, times))
+
+    for palette_size in args.colors:
+        p.loadImage(path, palette_size=palette_size)
+        runs = [{"method": "kmeans", "engine": engine} for engine in args.engines]
+        runs += [
+            {"method": "kmeans", "engine": engine, "histogram": True}
+            for engine in args.engines
+            if engine != "naive"
+        ]
+        runs += [{"method": method} for method in args.methods]
+
+        for params in runs:
+            times = measure(
+                lambda: p.extractColors(seed=args.seed, **params), args.repeat
+            )
+            results.append(
+                record(
+                    name,
+                    size,
+                    "extractColors",
+                    {"palette_size": palette_size, **params},
+                    times,
+                )
+            )
+
+    phases = {
+        "generatePalette": lambda: p.generatePalette(),
+        "savePaletteImage": lambda: p.savePaletteImage(folder=folder),
+        "savePaletteJSON": lambda: p.savePaletteJSON(folder=folder),
+    }
+    for position in Position:
+        phases[
+            f"incorporatePalette-{position.value}"
+        ] = lambda position=position: p.incorporatePalette(position=position)
+    phases["saveIncorporatedPalette"] = lambda: p.saveIncorporatedPalette(folder=folder)
+
+    for phase, function in phases.items():
+        times = measure(function, args.repeat)
+        results.append(
+            record(name, size, phase, {"palette_size": args.colors[-1]}, times)
+        )
+
+    # the images are saved as png above
+    for format in ("jpeg", "webp"):
+        times = measure(
+            lambda: p.saveIncorporatedPalette(folder=folder, format=format),
+            args.repeat,
+        )
+        results.append(
+            record(
+                name,
+                size,
+                "saveIncorporatedPalette",
+                {"palette_size": args.colors[-1], "format": format},
+                times,
+            )
+        )
+
+    return results
+
+
+def benchmark_startup(args: argparse.Namespace, folder: str) -> list[dict]:
+    """Benchmark the start-up of the command line interface.
+
+    Each run is a new Python process, like the short-lived invocations \
+        of a job scheduler: printing the help only parses the arguments, \
+        the JSON run extracts the palette of a tiny image.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        folder (str): Output folder of the saved files.
+
+    Returns:
+        list[dict]: Benchmark records.
+    """
+    size = (160, 120)
+    path = os.path.join(folder, "startup.png")
+    photo_image(*size, np.random.default_rng(args.seed)).save(path)
+
+    runs = {
+        "help": ["--help"],
+        "json": ["-i", path, "--json", "-o", folder, "--seed", str(args.seed)],
+    }
+    results = []
+    for name, cli_args in runs.items():
+        # log to the discarded console instead of a file next to the script
+        command = [sys.executable, CLI, *cli_args, "--console"]
+        times = measure(
+            lambda: subprocess.run(command, check=True, capture_output=True),
+            args.repeat,
+        )
+        results.append(record("cli", size, "startup", {"run": name}, times))
+
+    return results
+
+
+def run(args: argparse.Namespace):
+    """Run the benchmark and save the results.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+    """
+    rng = np.random.default_rng(args.seed)
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder += "/"
+        results.extend(benchmark_startup(args, folder))
+        if args.startup:
+            args.images = []
+
+        for name in args.images:
+            for megapixels in args.megapixels:
+                width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+                height = int(width * 3 / 4)
+                path = os.path.join(folder, f"{name}-{width}x{height}.{args.format}")
+                IMAGES[name](width, height, rng).save(path)
+
+                results.extend(
+                    benchmark_image(args, name, path, (width, height), folder)
+                )
+
+    output = {
+        "created": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+
+    print(f"Results saved. Path: {args.output}")
+
+
+def compare(paths: list[str], threshold: float) -> int:
+    """Compare the results of two benchmark runs.
+
+    Args:
+        paths (list[str]): Paths to the baseline and the new results.
+        threshold (float): Relative slowdown reported as a regression.
+
+    Returns:
+        int: Number of regressions.
+    """
+    runs = []
+    for path in paths:
+        with open(path, "r") as f:
+            runs.append(
+                {
+                    (
+                        r["image"],
+                        tuple(r["size"]),
+                        r["phase"],
+                        json.dumps(r["params"], sort_keys=True),
+                    ): r["best"]
+                    for r in json.load(f)["results"]
+                }
+            )
+
+    baseline, new = runs
+    regressions = 0
+    for key in sorted(baseline.keys() & new.keys()):
+        ratio = new[key] / baseline[key] if baseline[key] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        image, size, phase, params = key
+        print(
+            f"{image:>8} {size[0]:>5}x{size[1]:<5} {phase:<24} {params:<60} "
+            f"{baseline[key]:.4f}s -> {new[key]:.4f}s ({ratio:.2f}x){flag}"
+        )
+
+    print(f"{regressions} regressions over {threshold:.0%}")
+    return regressions
+
+
+def main():
+    """Run the main function."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the palette extraction on synthetic images"
+    )
+    parser.add_argument(
+        "--images",
+        help="Kinds of synthetic images. Default: all",
+        nargs="+",
+        choices=list(IMAGES),
+        default=list(IMAGES),
+    )
+    parser.add_argument(
+        "--megapixels",
+        help="Sizes of the images in megapixels. Default: 0.25 1",
+        nargs="+",
+        type=float,
+        default=[0.25, 1],
+    )
+    parser.add_argument(
+        "--colors",
+        help="Palette sizes. Default: 5 16",
+        nargs="+",
+        type=int,
+        default=[5, 16],
+    )
+    parser.add_argument(
+        "--engines",
+        help="KMeans engines. The naive engine is very slow. Default: numpy hamerly",
+        nargs="+",
+        choices=["naive", "numpy", "hamerly"],
+        default=["numpy", "hamerly"],
+    )
+    parser.add_argument(
+        "--methods",
+        help="Other quantization methods. Default: median-cut octree pillow",
+        nargs="+",
+        choices=["median-cut", "octree", "pillow"],
+        default=["median-cut", "octree", "pillow"],
+    )
+    parser.add_argument(
+        "--format",
+        help="File format of the synthetic images. Default: jpg",
+        choices=["jpg", "png"],
+        default="jpg",
+    )
+    parser.add_argument(
+        "--startup",
+        help="Only measure the start-up time of imagepalette.py, printing the help "
+        "and saving the JSON palette of a tiny image",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of runs of each measurement, the best one is compared. "
+        "Default: 3",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed of the synthetic images and of the extraction. Default: 42",
+        type=int,
+        default=42,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Path of the JSON results. Default: bench_output.json",
+        default="bench_output.json",
+    )
+    parser.add_argument(
+        "--compare",
+        help="Compare two JSON results instead of running the benchmark",
+        nargs=2,
+        metavar=("BASELINE", "NEW"),
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Relative slowdown reported as a regression by --compare. " "Default: 0.1",
+        type=float,
+        default=0.1,
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare, args.threshold) else 0)
+
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,85 @@
 """Extract color palette from any image."""
+from __future__ import annotations
 
 import argparse
 import logging
+from typing import TYPE_CHECKING
 
 from modules.color import Color
-from modules.palette_extractor import PaletteExtractor
 from modules.position import Position
 
+# numpy and Pillow take longer to import than parsing the arguments,
+# the modules using them are only imported when an image is processed
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
 
-def main():
-    """Run the main function."""
-    parser = argparse.ArgumentParser(description="Extract color palette from any image")
+    from modules.palette_extractor import PaletteExtractor
+
+
+def paletteSize(value: str) -> int | str:
+    """Parse the number of colors, an integer or "auto".
+
+    Args:
+        value (str)
+
+    Returns:
+        int | str
+    """
+    if value == "auto":
+        return value
+
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid number of colors: '{value}', pass an integer or auto"
+        )
+
+
+def createParser(
+    description: str = "Extract color palette from any image",
+    parser_class: type = argparse.ArgumentParser,
+) -> argparse.ArgumentParser:
+    """Create the parser of the command line arguments.
+
+    Args:
+        description (str, optional): Description of the program.
+        parser_class (type, optional): Class of the parser. \
+            Defaults to argparse.ArgumentParser.
+
+    Returns:
+        argparse.ArgumentParser
+    """
+    parser = parser_class(description=description)
     parser.add_argument("-i", "--input", help="Source image path")
     parser.add_argument(
         "-o", "--output", help="Custom output folder", default="output/"
     )
     parser.add_argument(
-        "-c", "--colors", help="Number of extracted colors", type=int, default=5
+        "-c",
+        "--colors",
+        help="Number of extracted colors. Pass auto to choose it with the KMeans "
+        "algorithm in the range of --colors-range. Default: 5",
+        type=paletteSize,
+        default=5,
+    )
+    parser.add_argument(
+        "--colors-range",
+        help="Smallest and largest number of colors compared by --colors auto. "
+        "Default: 2 10",
+        nargs=2,
+        type=int,
+        metavar=("MIN", "MAX"),
+        default=[2, 10],
+    )
+    parser.add_argument(
+        "--colors-criterion",
+        help="Criterion choosing the number of colors with --colors auto. "
+        "silhouette prefers well separated colors, elbow the number after which "
+        "more colors improve the palette slowly. Valid values: silhouette, elbow. "
+        "Default: silhouette",
+        choices=["silhouette", "elbow"],
+        default="silhouette",
     )
     parser.add_argument(
         "-r",
@@ -25,6 +88,28 @@ def main():
         "Calculations will be quicker but slightly less accurate",
         action="store_true",
     )
+    parser.add_argument(
+        "--resize-width",
+        help="Width of the resized image, implies --resize. Default: 1000",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--resize-megapixels",
+        help="Area of the resized image in megapixels, implies --resize. "
+        "Overrides --resize-width",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--resample",
+        help="Resampling filter used to resize the image. "
+        "Valid values: nearest, box, bilinear, hamming, bicubic, lanczos. "
+        "Default: bicubic",
+        type=str,
+        choices=["nearest", "box", "bilinear", "hamming", "bicubic", "lanczos"],
+        default="bicubic",
+    )
     parser.add_argument("--console", help="Log to console", action="store_true")
     parser.add_argument(
         "--palette", help="Create an image containing the palette", action="store_true"
@@ -102,10 +187,23 @@ def main():
         type=int,
         default=None,
     )
+    parser.add_argument(
+        "--method",
+        help="Algorithm used to extract the palette. kmeans is the most accurate, "
+        "median-cut and octree are single pass and faster, pillow uses the "
+        "median cut implemented in C by Pillow. The KMeans arguments only apply "
+        "to kmeans. Valid values: kmeans, median-cut, octree, pillow. "
+        "Default: kmeans",
+        type=str,
+        choices=["kmeans", "median-cut", "octree", "pillow"],
+        default="kmeans",
+    )
     parser.add_argument(
         "--min-color-distance",
-        help="Minimum square distance between colors in the palette. " "Default: 35",
-        type=int,
+        help="The KMeans algorithm stops when the average distance between the "
+        "pixels and their color is below this value, in RGB units (converted to "
+        "the smaller CIELAB distances with --color-space lab). Default: 35",
+        type=float,
         default=35,
     )
     parser.add_argument(
@@ -116,14 +214,257 @@ def main():
         type=int,
         default=10,
     )
+    parser.add_argument(
+        "--max-total-iterations",
+        help="Maximum number of iterations for the KMeans algorithm, changed or "
+        "not. When reached, the best palette found so far is kept and marked "
+        "as truncated",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="Stop the KMeans algorithm when no color moves farther than this "
+        "distance in an iteration. Default: 0",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--max-time",
+        help="Maximum duration of the KMeans algorithm in seconds. When it "
+        "expires, the best palette found so far is kept and marked as truncated",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--engine",
+        help="Implementation of the KMeans algorithm. "
+        "All engines return the same palette for the same seed, "
+        "numpy is much faster than naive, hamerly skips most distance "
+        "computations, which only pays off on fits with many iterations. "
+        "Valid values: naive, numpy, hamerly. Default: numpy",
+        type=str,
+        choices=["naive", "numpy", "hamerly"],
+        default="numpy",
+    )
+    parser.add_argument(
+        "--histogram",
+        help="Cluster the unique colors of the image weighted by their count "
+        "instead of every pixel. Much faster, not supported by the naive engine",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--init",
+        help="Initialization of the KMeans centroids. "
+        "k-means++ spreads the initial colors and converges faster, "
+        "k-means|| is its scalable variant for large images. "
+        "Valid values: random, k-means++, k-means||. Default: random",
+        type=str,
+        choices=["random", "k-means++", "k-means||"],
+        default="random",
+    )
+    parser.add_argument(
+        "--n-init",
+        help="Number of KMeans runs with different seeds, "
+        "the one with the lowest inertia is kept. Default: 1",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--jobs",
+        help="Number of processes running the KMeans runs, or clustering the "
+        "tiles with --tiles. Pass 0 to use all the cores. Default: 1",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="Fit the KMeans model on random batches of this many pixels, "
+        "so that only the sampled pixels are copied instead of all of them. "
+        "The decoded image is still held in memory. "
+        "Not supported by the naive engine",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--max-batches",
+        help="Maximum number of batches used in the mini-batch mode. Default: 1000",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "--sample",
+        help="Fit the KMeans model on a random sample of the pixels at full "
+        "resolution instead of all of them. uniform draws any pixel, stratified "
+        "one pixel in each cell of a grid, reservoir visits every pixel once (slower "
+        "than uniform). Valid values: uniform, stratified, reservoir",
+        type=str,
+        choices=["uniform", "stratified", "reservoir"],
+        default=None,
+    )
+    parser.add_argument(
+        "--sample-size",
+        help="Number of sampled pixels. Default: 100000, or 20000 for the first "
+        "sample with --sample-error",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--sample-error",
+        help="Target standard error of the colors: the sample is enlarged until "
+        "the error estimated on a first sample is reached",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--sample-refine",
+        help="Refine the colors found on the sample with a pass over all the pixels",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--tiles",
+        help="Cluster each square tile of this many pixels on its own and merge "
+        "their clusters, so that the tiles can be clustered in parallel with "
+        "--jobs. Only with the kmeans method, without --n-init, --batch-size, "
+        "--frames, --initial-palette and --cache",
+        type=int,
+        metavar="SIZE",
+        default=None,
+    )
+    parser.add_argument(
+        "--tile-colors",
+        help="Number of clusters of each tile. Default: twice --colors",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--tile-refine",
+        help="Number of passes over the tiles refining the merged colors. "
+        "Default: 1",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--tile-compare",
+        help="Also extract the palette from the whole image and log how far "
+        "the tiled palette is from it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--color-space",
+        help="Color space the KMeans algorithm clusters the pixels in. "
+        "In lab (CIELAB) the distances match the perceived difference between "
+        "colors. Not supported by the naive engine. Valid values: rgb, lab. "
+        "Default: rgb",
+        type=str,
+        choices=["rgb", "lab"],
+        default="rgb",
+    )
+    parser.add_argument(
+        "--initial-palette",
+        help="Palette JSON file the KMeans colors start from, for example the "
+        "palette of a previous version of the image. Converges in a few "
+        "iterations and keeps the order of the colors. It must contain as many "
+        "colors as --colors. Only with the kmeans method, without --n-init",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--frames",
+        help="Extract the palette of every frame of an animated or multi-page "
+        "image (GIF, APNG, TIFF), each frame starting from the colors of the "
+        "previous one. The palette of all the frames is used for the other "
+        "outputs, --json saves all the palettes in a single file. "
+        "Only with the kmeans method, without --n-init, --batch-size and --cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache",
+        help="Load the palette from the cache if the same image has already been "
+        "processed with the same parameters, and store it otherwise. "
+        "Requires --seed or --initial-palette with the kmeans method",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Folder of the palette cache. Default: ~/.cache/image-palette/",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="Maximum size of the palette cache in MiB, "
+        "the least recently used palettes are removed first. Default: 16",
+        type=float,
+        default=16,
+    )
+    parser.add_argument(
+        "--clear-cache",
+        help="Remove all the palettes from the cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Append the time spent in each phase, the KMeans iterations and "
+        "the number of pixels processed to this JSON lines file",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-memory",
+        help="Add the peak memory allocated by Python and numpy to the metrics. "
+        "Slows down the extraction",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--format",
+        help="Format of the saved images. jpeg and webp are much smaller "
+        "and faster to encode for large photos. Valid values: png, jpeg, webp. "
+        "Default: png",
+        choices=["png", "jpeg", "webp"],
+        default="png",
+    )
+    parser.add_argument(
+        "--quality",
+        help="Quality of the jpeg and webp images, in range 0-100. "
+        "Default: 75 for jpeg, 80 for webp",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--compression",
+        help="Compression level of the png images (range 0-9, default 6) or "
+        "compression method of the webp images (range 0-6, default 4). "
+        "Lower values are faster to encode but give bigger files",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--low-memory",
+        help="Release the image once the colors are extracted and decode it again "
+        "to incorporate the palette, so that the palette is incorporated with "
+        "only the decoded image and the output in memory. Extracting the colors "
+        "without --resize still copies the pixels. Useful for very large images",
+        action="store_true",
+    )
 
-    args = parser.parse_args()
+    return parser
 
-    # some args might not be valid, if so quit the script
-    if not args.input:
-        parser.error("Specify the input image. Use -h to get a list of commands.")
 
-    if not any(
+def checkArgs(
+    parser: argparse.ArgumentParser,
+    args: argparse.Namespace,
+    require_output: bool = True,
+):
+    """Check the output and incorporated mode arguments, quit if they are not valid.
+
+    Args:
+        parser (argparse.ArgumentParser)
+        args (argparse.Namespace)
+        require_output (bool, optional): Check that a type of output is selected. \
+            Defaults to True.
+    """
+    if require_output and not any(
         [
             args.palette,
             args.print,
@@ -149,18 +490,148 @@ def main():
             "The outline specified is wrong. Use -h to get a list of commands."
         )
 
-    if not any(args.position.lower() == p for p in ["l", "r", "t", "b"]):
+    if args.frames and (
+        args.method != "kmeans"
+        or args.n_init > 1
+        or args.batch_size is not None
+        or args.cache
+    ):
+        parser.error(
+            "--frames only works with the kmeans method, "
+            "without --n-init, --batch-size and --cache"
+        )
+
+    if args.initial_palette and (
+        args.method != "kmeans" or args.n_init > 1 or args.frames
+    ):
+        parser.error(
+            "--initial-palette only works with the kmeans method, "
+            "without --n-init and --frames"
+        )
+
+    if args.colors == "auto" and (
+        args.method != "kmeans"
+        or args.n_init > 1
+        or args.batch_size is not None
+        or args.frames
+        or args.initial_palette
+        or args.cache
+    ):
+        parser.error(
+            "--colors auto only works with the kmeans method, without --n-init, "
+            "--batch-size, --frames, --initial-palette and --cache"
+        )
+
+    if args.tiles is not None and (
+        args.method != "kmeans"
+        or args.n_init > 1
+        or args.batch_size is not None
+        or args.frames
+        or args.initial_palette
+        or args.cache
+        or args.colors == "auto"
+    ):
+        parser.error(
+            "--tiles only works with the kmeans method, without --n-init, "
+            "--batch-size, --frames, --initial-palette, --cache and --colors auto"
+        )
+
+    if (
+        args.cache
+        and args.method == "kmeans"
+        and args.seed is None
+        and not args.initial_palette
+    ):
+        # random centroids give a different palette each time
+        parser.error("--cache requires --seed or --initial-palette with kmeans")
+
+    if (
+        args.max_total_iterations is not None
+        or args.tolerance
+        or args.max_time is not None
+    ) and (
+        args.batch_size is not None
+        or args.frames
+        or args.colors == "auto"
+        or args.tiles is not None
+    ):
+        parser.error(
+            "--max-total-iterations, --tolerance and --max-time do not work with "
+            "--batch-size, --frames, --colors auto and --tiles"
+        )
+
+    if args.max_total_iterations is not None and args.max_total_iterations < 1:
+        parser.error("The maximum number of iterations must be at least 1")
+
+    if args.tolerance < 0:
+        parser.error("The tolerance must not be negative")
+
+    if args.max_time is not None and args.max_time <= 0:
+        parser.error("The maximum time must be positive")
+
+    if args.sample is None and (
+        args.sample_size is not None
+        or args.sample_error is not None
+        or args.sample_refine
+    ):
+        parser.error("--sample-size, --sample-error and --sample-refine need --sample")
+
+    if args.sample is not None and (
+        args.method != "kmeans"
+        or args.batch_size is not None
+        or args.frames
+        or args.colors == "auto"
+        or args.tiles is not None
+    ):
+        parser.error(
+            "--sample only works with the kmeans method, without --batch-size, "
+            "--frames, --colors auto and --tiles"
+        )
+
+    if args.sample_size is not None and args.sample_size < 1:
+        parser.error("The sample size must be at least 1")
+
+    if args.sample_error is not None and args.sample_error <= 0:
+        parser.error("The sample error must be positive")
+
+    if args.tiles is not None and args.tiles < 1:
+        parser.error("The tile size must be at least 1")
+
+    if not 2 <= args.colors_range[0] <= args.colors_range[1]:
+        parser.error("The range of colors must start from at least 2 and be increasing")
+
+    if args.quality is not None and not 0 <= args.quality <= 100:
+        parser.error("The quality must be in range 0-100")
+
+    max_compression = {"png": 9, "webp": 6, "jpeg": None}[args.format]
+    if args.compression is not None and (
+        max_compression is None or not 0 <= args.compression <= max_compression
+    ):
+        parser.error(
+            "The compression must be in range 0-9 for png and 0-6 for webp, "
+            "jpeg has no compression level"
+        )
+
+    if args.position is not None and not any(
+        args.position.lower() == p for p in ["l", "r", "t", "b"]
+    ):
         parser.error(
             "The position specified is wrong. Use -h to get a list of commands"
         )
-        return
 
+
+def setupLogging(args: argparse.Namespace, logfile: str):
+    """Log to the console or to a file, depending on the arguments.
+
+    Args:
+        args (argparse.Namespace)
+        logfile (str): Path of the log file.
+    """
     if args.console:
         logging.basicConfig(
             format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
         )
     else:
-        logfile = __file__.replace(".py", ".log")
         logging.basicConfig(
             format="%(asctime)s - %(levelname)s - %(message)s",
             level=logging.INFO,
@@ -169,26 +640,133 @@ def main():
         )
         print(f"Logging in {logfile}. Use --console to view the log directly here")
 
+
+def processImage(
+    args: argparse.Namespace, path: str, executor: Executor = None
+) -> PaletteExtractor:
+    """Extract the palette of an image and create the requested outputs.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        path (str): Path to the image.
+        executor (Executor, optional): Executor encoding the images \
+            in the background, call waitSaved on the returned extractor \
+            to wait until they are written. Their save time is missing \
+            from the metrics. Defaults to None.
+
+    Returns:
+        PaletteExtractor
+    """
+    from modules.colorspace import scale_distance
+    from modules.metrics import Metrics
+    from modules.palette_cache import PaletteCache
+    from modules.palette_extractor import PaletteExtractor
+
     # add trailing slash to output folder
     if args.output[-1] != "/":
         output_folder = args.output + "/"
     else:
         output_folder = args.output
 
+    metrics = None
+    if args.metrics:
+        metrics = Metrics(path=args.metrics, trace_memory=args.trace_memory)
+
+    auto_colors = args.colors == "auto"
+    # the minimum distance is given in RGB units
+    min_dist = scale_distance(args.min_color_distance, args.color_space)
     # fire up the extractor and load an image
-    p = PaletteExtractor()
-    p.loadImage(path=args.input, palette_size=args.colors, resize=args.resize)
-    p.extractColors(
-        seed=args.seed, min_dist=args.min_color_distance, max_iter=args.max_iterations
+    p = PaletteExtractor(metrics=metrics, executor=executor)
+    p.loadImage(
+        path=path,
+        palette_size=None if auto_colors else args.colors,
+        resize=args.resize or bool(args.resize_width or args.resize_megapixels),
+        resize_width=args.resize_width,
+        resize_megapixels=args.resize_megapixels,
+        resample=args.resample,
+        low_memory=args.low_memory,
     )
+    cache = None
+    if args.cache:
+        cache = PaletteCache(
+            folder=args.cache_dir, max_size=int(args.cache_size * 2**20)
+        )
+
+    if args.frames:
+        p.extractFrameColors(
+            seed=args.seed,
+            min_dist=min_dist,
+            max_iter=args.max_iterations,
+            engine=args.engine,
+            histogram=args.histogram,
+            init=args.init,
+            color_space=args.color_space,
+        )
+    elif auto_colors:
+        p.extractAutoColors(
+            min_colors=args.colors_range[0],
+            max_colors=args.colors_range[1],
+            criterion=args.colors_criterion,
+            seed=args.seed,
+            min_dist=min_dist,
+            max_iter=args.max_iterations,
+            engine=args.engine,
+            init=args.init,
+            color_space=args.color_space,
+        )
+    elif args.tiles is not None:
+        p.extractTiledColors(
+            tile_size=args.tiles,
+            tile_colors=args.tile_colors,
+            refine_iterations=args.tile_refine,
+            n_jobs=args.jobs or None,
+            compare=args.tile_compare,
+            seed=args.seed,
+            min_dist=min_dist,
+            max_iter=args.max_iterations,
+            engine=args.engine,
+            init=args.init,
+            color_space=args.color_space,
+        )
+    else:
+        p.extractColors(
+            seed=args.seed,
+            method=args.method,
+            min_dist=min_dist,
+            max_iter=args.max_iterations,
+            engine=args.engine,
+            histogram=args.histogram,
+            init=args.init,
+            n_init=args.n_init,
+            n_jobs=args.jobs or None,
+            batch_size=args.batch_size,
+            max_batches=args.max_batches,
+            color_space=args.color_space,
+            initial_palette=args.initial_palette,
+            cache=cache,
+            max_total_iter=args.max_total_iterations,
+            tol=args.tolerance,
+            max_time=args.max_time,
+            sample=args.sample,
+            sample_size=args.sample_size,
+            sample_error=args.sample_error,
+            refine=args.sample_refine,
+        )
 
     if args.print:
         p.printPalette()
     if args.palette:
         p.generatePalette()
-        p.savePaletteImage(folder=output_folder)
-    if args.json:
-        p.savePaletteJSON()
+        p.savePaletteImage(
+            folder=output_folder,
+            format=args.format,
+            quality=args.quality,
+            compression=args.compression,
+        )
+    if args.json and args.frames:
+        p.saveFramesJSON(folder=output_folder)
+    elif args.json:
+        p.savePaletteJSON(folder=output_folder)
     if args.incorporated:
         background_color = Color(*args.color)
 
@@ -201,12 +779,48 @@ def main():
             output_scl=args.scl,
             color_width_scl=args.color_width_scl,
             color_height_scl=args.color_height_scl,
-            position=Position(args.position),
+            position=Position(args.position.lower()),
             background_color=background_color,
             outline_color=outline_color,
             line_width=args.outline_width,
         )
-        p.saveIncorporatedPalette(folder=output_folder)
+        p.saveIncorporatedPalette(
+            folder=output_folder,
+            format=args.format,
+            quality=args.quality,
+            compression=args.compression,
+        )
+
+    if metrics is not None:
+        metrics.write(
+            path=path,
+            palette_size=args.colors,
+            method=args.method,
+            engine=args.engine,
+        )
+
+    return p
+
+
+def main():
+    """Run the main function."""
+    parser = createParser()
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        from modules.palette_cache import PaletteCache
+
+        PaletteCache(folder=args.cache_dir).clear()
+        if not args.input:
+            return
+
+    # some args might not be valid, if so quit the script
+    if not args.input:
+        parser.error("Specify the input image. Use -h to get a list of commands.")
+
+    checkArgs(parser, args)
+    setupLogging(args, __file__.replace(".py", ".log"))
+    processImage(args, args.input)
 
 
 if __name__ == "__main__":
@@ -5,12 +5,23 @@ from typing import Any
 
 
 class Color:
-    """Class containing all information about a color."""
+    """Class containing all information about a color.
+
+    Colors are immutable and interned: creating a color with the same \
+        components as an existing one returns the same object, \
+        until the cache is full.
+    """
+
+    __slots__ = ("_rgb", "_hsv", "_hex")
+
+    # interned colors, by RGB components
+    _cache: dict[tuple[int, int, int], Color] = {}
+    # maximum number of interned colors, about 10 MB
+    _cache_size: int = 2**16
 
-    _frozen: bool = False
     # class containing all information about a color
-    def __init__(self, r: int, g: int, b: int) -> Color:
-        """Initialize a Color object.
+    def __new__(cls, r: int, g: int, b: int) -> Color:
+        """Create a Color object, or return the interned one.
 
         Args:
             r (int): red component (range 0-255)
@@ -20,6 +31,11 @@ class Color:
         Returns:
             Color
         """
+        rgb = (r, g, b)
+        color = cls._cache.get(rgb)
+        if color is not None:
+            return color
+
         if not (0 <= r <= 255):
             raise ValueError("Red component must be in range 0-255")
 
@@ -29,9 +45,21 @@ class Color:
         if not (0 <= b <= 255):
             raise ValueError("Blue component must be in range 0-255")
 
-        self._rgb = (r, g, b)
-        self._hsv = self._toHSV(r, g, b)
-        self._frozen = True
+        color = super().__new__(cls)
+        # HSV and hex are only computed when first needed
+        object.__setattr__(color, "_rgb", rgb)
+        object.__setattr__(color, "_hsv", None)
+        object.__setattr__(color, "_hex", None)
+
+        if len(cls._cache) < cls._cache_size:
+            cls._cache[rgb] = color
+
+        return color
+
+    @classmethod
+    def clear_cache(cls) -> None:
+        """Remove all the interned colors."""
+        cls._cache.clear()
 
     def _toHSV(self, R: int, G: int, B: int) -> tuple[int, int, int]:
         r = R / 255
@@ -68,11 +96,57 @@ class Color:
             __value (Any)
 
         Raises:
-            AttributeError: thrown if the object is frozen
+            AttributeError: always thrown, the object is immutable
+        """
+        raise AttributeError("Color object is immutable")
+
+    def __delattr__(self, __name: str) -> None:
+        """Delete attribute.
+
+        Args:
+            __name (str)
+
+        Raises:
+            AttributeError: always thrown, the object is immutable
+        """
+        raise AttributeError("Color object is immutable")
+
+    def __eq__(self, other: Any) -> bool:
+        """Check if two colors have the same RGB components.
+
+        Args:
+            other (Any)
+
+        Returns:
+            bool
+        """
+        if not isinstance(other, Color):
+            return NotImplemented
+        return self._rgb == other._rgb
+
+    def __hash__(self) -> int:
+        """Return the hash of the RGB components.
+
+        Returns:
+            int
+        """
+        return hash(self._rgb)
+
+    def __repr__(self) -> str:
+        """Return a string representation of the color.
+
+        Returns:
+            str
         """
-        if self._frozen:
-            raise AttributeError("Color object is immutable")
-        super().__setattr__(__name, __value)
+        return f"Color{self._rgb}"
+
+    def __reduce__(self) -> tuple:
+        """Return the arguments used to pickle the color.
+
+        Returns:
+            tuple
+        """
+        return (Color, self._rgb)
 
     # getter functions
     @property
@@ -84,6 +158,7 @@ class Color:
         """
         return self._rgb[0]
 
+    @property
     def g(self) -> int:
         """Get the green component of the color.
 
@@ -92,6 +167,7 @@ class Color:
         """
         return self._rgb[1]
 
+    @property
     def b(self) -> int:
         """Get the blue component of the color.
 
@@ -107,7 +183,7 @@ class Color:
         Returns:
             tuple[int, int, int]: RGB components (range 0-255)
         """
-        return tuple(self._rgb)
+        return self._rgb
 
     @property
     def hsv(self) -> tuple[int, int, int]:
@@ -116,7 +192,9 @@ class Color:
         Returns:
             tuple[int, int, int]:
         """
-        return tuple(self._hsv)
+        if self._hsv is None:
+            object.__setattr__(self, "_hsv", self._toHSV(*self._rgb))
+        return self._hsv
 
     @property
     def hsv_formatted(self) -> str:
@@ -125,7 +203,8 @@ class Color:
         Returns:
             str
         """
-        return f"hsv({self._hsv[0]}°, {self._hsv[1]}%, {self._hsv[2]}%)"
+        h, s, v = self.hsv
+        return f"hsv({h}°, {s}%, {v}%)"
 
     @property
     def rgb_formatted(self) -> str:
@@ -143,7 +222,7 @@ class Color:
         Returns:
             int
         """
-        return self._hsv[0]
+        return self.hsv[0]
 
     @property
     def saturation(self) -> int:
@@ -152,7 +231,7 @@ class Color:
         Returns:
             int
         """
-        return self._hsv[1]
+        return self.hsv[1]
 
     @property
     def hex(self) -> str:
@@ -161,4 +240,10 @@ class Color:
         Returns:
             str
         """
-        return f"#{''.join([hex(x)[2:].zfill(2) for x in self._rgb]).upper()}"
+        if self._hex is None:
+            object.__setattr__(
+                self,
+                "_hex",
+                f"#{''.join([hex(x)[2:].zfill(2) for x in self._rgb]).upper()}",
+            )
+        return self._hex
@@ -0,0 +1,157 @@
+"""Batch journal module."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+
+
+def fingerprint(path: str, read_size: int = 2**20) -> dict:
+    """Get the size, modification time and hash of a file.
+
+    Args:
+        path (str)
+        read_size (int, optional): Number of bytes hashed at once. \
+            Defaults to 1 MiB.
+
+    Returns:
+        dict: size in bytes, mtime_ns and sha256 hex digest.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(read_size):
+            digest.update(chunk)
+
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+    }
+
+
+class Journal:
+    """Append-only record of the images converted by a batch run.
+
+    Each line of the file is a JSON document describing the conversion \
+        of an image: its path, fingerprint, parameters, output files and \
+        error, if any. Every conversion is written as soon as it ends, \
+        so an interrupted run loses at most the images being converted, \
+        and the next run skips the images that are unchanged since their \
+        last successful conversion with the same parameters.
+    """
+
+    def __init__(self, path: str) -> Journal:
+        """Initialize a Journal object, reading the existing entries.
+
+        Args:
+            path (str): Path to the JSON-lines file, created on the first record.
+
+        Returns:
+            Journal
+        """
+        self._path = pathlib.Path(path)
+        # last entry of each image, by absolute path
+        self._entries = {}
+
+        if not self._path.is_file():
+            return
+
+        with open(self._path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of an interrupted run can be incomplete
+                    logging.warning(f"Skipping a malformed line of {self._path}")
+                    continue
+                self._entries[entry["path"]] = entry
+
+        logging.info(f"Read {len(self._entries)} images from the journal {self._path}")
+
+    def isDone(self, path: str, params: dict) -> bool:
+        """Check if an image has been converted and has not changed since.
+
+        The image is unchanged if its size and modification time are the same, \
+            or else if its hash is the same. Its output files must still exist.
+
+        Args:
+            path (str): Path to the image.
+            params (dict): Parameters of the conversion, must be JSON serializable.
+
+        Returns:
+            bool
+        """
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        if entry is None or entry.get("error") is not None:
+            return False
+
+        # compare the parameters as they are read back from the file
+        if entry["params"] != json.loads(json.dumps(params)):
+            return False
+
+        if not all(os.path.exists(output) for output in entry["outputs"]):
+            return False
+
+        stat = os.stat(path)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+
+        # the file was touched or copied, check its content
+        current = fingerprint(path)
+        if current["sha256"] != entry["sha256"]:
+            return False
+
+        # record the new modification time, so that it is not hashed again
+        self.record(
+            path,
+            params,
+            current,
+            entry["outputs"],
+            truncated=entry.get("truncated", False),
+        )
+        return True
+
+    def record(
+        self,
+        path: str,
+        params: dict,
+        file: dict = None,
+        outputs: list[str] = None,
+        error: str = None,
+        truncated: bool = False,
+    ):
+        """Append the conversion of an image to the journal.
+
+        Args:
+            path (str): Path to the image.
+            params (dict): Parameters of the conversion, must be JSON serializable.
+            file (dict, optional): Fingerprint of the image when it was \
+                converted, as returned by fingerprint. Defaults to None.
+            outputs (list[str], optional): Paths of the output files. \
+                Defaults to None.
+            error (str, optional): Error of a failed conversion. Defaults to None.
+            truncated (bool, optional): The KMeans fit was truncated. \
+                Defaults to False.
+        """
+        entry = {
+            "path": os.path.abspath(path),
+            **(file or {"size": None, "mtime_ns": None, "sha256": None}),
+            "params": params,
+            "outputs": [os.path.abspath(output) for output in outputs or []],
+            "truncated": truncated,
+            "error": error,
+        }
+        self._entries[entry["path"]] = entry
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            # the entry must survive a crash of the next conversions
+            f.flush()
+            os.fsync(f.fileno())
@@ -2,18 +2,63 @@
 from __future__ import annotations
 
 import logging
+import os
 import random
+import time
 from datetime import datetime
+from itertools import repeat
+
+import numpy as np
 
 from .color import Color
+from .colorspace import lab_to_rgb, rgb_to_lab
+from .metrics import Metrics, timed
 
 
 class KMeans:
-    """Naive implementation of KMeans clustering algorithm."""
+    """KMeans clustering algorithm, with several engines.
+
+    The engine is chosen with the engine argument: "naive" loops over \
+        Color objects, "numpy" works on a Nx3 array and "hamerly" also works \
+        on an array but skips the distance computations that cannot change \
+        the cluster of a pixel. All of them yield the same centroids for the \
+        same seed. Every engine supports the k-means++ and k-means|| \
+        initializations (init) and several runs (n_init), only the array \
+        engines support weighted pixels, mini-batch fitting (partial_fit) \
+        and clustering in the CIELAB color space (color_space).
+    """
 
     _centroids: list[Color] = None
     _clusters: list[list[Color]] = None
     _avg_dist: float = None
+    _labels: np.ndarray = None
+    _centroid_array: np.ndarray = None
+    _unchanged_batches: int = 0
+    _bounds: tuple[np.ndarray, np.ndarray, np.ndarray] = None
+    # float points, their channels, squared norms, weights and cluster
+    # statistics kept across the iterations of the hamerly engine
+    _bounded_points: tuple[np.ndarray, list[np.ndarray], np.ndarray, np.ndarray] = None
+    _bounded_stats: tuple[np.ndarray, np.ndarray, np.ndarray] = None
+    _metrics: Metrics = None
+    # time.time() after which the fit stops, shared by the restarts
+    _deadline: float = None
+    _truncated: bool = False
+
+    engines: tuple[str, ...] = ("naive", "numpy", "hamerly")
+    inits: tuple[str, ...] = ("random", "k-means++", "k-means||")
+    color_spaces: tuple[str, ...] = ("rgb", "lab")
+    # slack on the distance bounds of the hamerly engine, far smaller than
+    # the gap between two different distances of integer colors
+    _bounds_tol: float = 1e-6
+    # number of sampling rounds of the k-means|| initialization
+    _parallel_init_rounds: int = 5
+    # a mini-batch leaves the centroids unchanged if none of them moves
+    # farther than this distance
+    _batch_shift_tol: float = 0.5
+    # smoothing factor of the average distance across mini-batches
+    _batch_smoothing: float = 0.1
+    # number of pixels whose distances are computed at once by the numpy engine
+    _chunk_size: int = 2**16
 
     def __init__(
         self,
@@ -21,6 +66,16 @@ class KMeans:
         random_seed: int = None,
         min_dist: float = 1,
         max_iterations: int = 5,
+        engine: str = "naive",
+        init: str = "random",
+        n_init: int = 1,
+        n_jobs: int = 1,
+        color_space: str = "rgb",
+        initial_centroids: list[Color] | np.ndarray = None,
+        metrics: Metrics = None,
+        max_total_iterations: int = None,
+        tol: float = 0,
+        max_time: float = None,
     ) -> KMeans:
         """Initialize a KMeans object.
 
@@ -32,26 +87,137 @@ class KMeans:
                 Defaults to 1.
             max_iterations (int, optional): maximum number of iterations. \
                 Defaults to 5.
+            engine (str, optional): implementation used to fit the model. \
+                "naive" loops over Color objects, "numpy" works on a Nx3 array \
+                and yields the same centroids for the same seed, "hamerly" \
+                also works on an array but skips the distance computations \
+                that provably cannot change the assignment of a pixel, \
+                yielding the same centroids as "numpy". Defaults to "naive".
+            init (str, optional): initialization of the centroids. \
+                "random" picks random pixels, "k-means++" spreads the centroids \
+                with greedy D² sampling, "k-means||" is the scalable variant of \
+                k-means++ for large inputs. Defaults to "random".
+            n_init (int, optional): number of fits with different seeds, \
+                the one with the lowest inertia is kept. Defaults to 1.
+            n_jobs (int, optional): number of processes running the fits. \
+                If None, all the cores are used. Defaults to 1.
+            color_space (str, optional): space the pixels are clustered in. \
+                "rgb" or "lab" (CIELAB, where distances match the perceived \
+                difference between colors, array engines only). The average \
+                distance and min_dist are measured in this space. \
+                Defaults to "rgb".
+            initial_centroids (list[Color] | np.ndarray, optional): colors \
+                the centroids start from instead of the init method, \
+                for example the palette of a similar image. \
+                Defaults to None.
+            metrics (Metrics, optional): record of the time spent seeding, \
+                assigning and fitting, the number of points, the number of \
+                points whose distances were computed and the inertia after \
+                each iteration. With n_init > 1 only the times are recorded. \
+                Defaults to None.
+            max_total_iterations (int, optional): maximum number of iterations \
+                of a fit, changed or not. If reached, the fit is truncated. \
+                Defaults to None.
+            tol (float, optional): the fit is completed when no centroid moves \
+                farther than this distance in an iteration. Defaults to 0.
+            max_time (float, optional): maximum duration of the fit in seconds, \
+                shared by the n_init runs. When it expires the fit is truncated \
+                after the current iteration and the runs that have not \
+                started are skipped. Defaults to None.
 
         Returns:
             KMeans
         """
+        if engine not in self.engines:
+            raise ValueError(f"Engine must be one of {', '.join(self.engines)}")
+
+        if init not in self.inits:
+            raise ValueError(f"Init must be one of {', '.join(self.inits)}")
+
+        if n_init < 1:
+            raise ValueError("n_init must be at least 1")
+
+        if max_total_iterations is not None and max_total_iterations < 1:
+            raise ValueError("max_total_iterations must be at least 1")
+
+        if tol < 0:
+            raise ValueError("tol must not be negative")
+
+        if max_time is not None and max_time <= 0:
+            raise ValueError("max_time must be positive")
+
+        if color_space not in self.color_spaces:
+            raise ValueError(
+                f"Color space must be one of {', '.join(self.color_spaces)}"
+            )
+
+        if engine == "naive" and color_space != "rgb":
+            raise ValueError("The naive engine only clusters in the rgb color space")
+
+        if initial_centroids is not None:
+            initial_centroids = self._toArray(initial_centroids)
+            if len(initial_centroids) != n_clusters:
+                raise ValueError(
+                    "The number of initial centroids must be equal to n_clusters"
+                )
+            if n_init > 1:
+                raise ValueError("Initial centroids cannot be used with n_init > 1")
+
         self._n_clusters = n_clusters
         self._random_seed = random_seed
         self._min_dist = min_dist
         self._max_iterations = max_iterations
+        self._engine = engine
+        self._init = init
+        self._n_init = n_init
+        self._n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        self._color_space = color_space
+        self._initial_centroids = initial_centroids
+        self._metrics = metrics
+        self._max_total_iterations = max_total_iterations
+        self._tol = tol
+        self._max_time = max_time
+        # distances between 8 bit colors and integer centroids are exact
+        # in float32, while CIELAB coordinates need double precision
+        self._dtype = np.float32 if color_space == "rgb" else np.float64
 
         if random_seed is None:
             self._random_seed = int(datetime.now().timestamp())
 
+    def __getstate__(self) -> dict:
+        """Get the state used to pickle the model, without the fitted pixels.
+
+        Returns:
+            dict
+        """
+        state = self.__dict__.copy()
+        for key in (
+            "_pixels",
+            "_points",
+            "_weights",
+            "_bounds",
+            "_bounded_points",
+            "_bounded_stats",
+            "_metrics",
+        ):
+            state.pop(key, None)
+        return state
+
     def _toFixed(self, num: float, digits: int = 3) -> float:
         return float(f"{num:.{digits}f}")
 
-    def fit(self, pixels: list[Color]) -> KMeans:
+    @timed("fit")
+    def fit(
+        self, pixels: list[Color] | np.ndarray, weights: np.ndarray = None
+    ) -> KMeans:
         """Fit the KMeans model.
 
         Args:
-            pixels (list[Color]): list of Color objects
+            pixels (list[Color] | np.ndarray): list of Color objects or, \
+                for the array engines, a Nx3 array of RGB values
+            weights (np.ndarray, optional): number of occurrences of each pixel, \
+                used to cluster an histogram of unique colors instead of \
+                every pixel (not supported by the naive engine). Defaults to None.
 
         Returns:
             KMeans
@@ -60,20 +226,45 @@ class KMeans:
             "Starting fit of KMeans model. "
             f"n_clusters={self._n_clusters}, min_dist={self._min_dist}, "
             f"random_seed={self._random_seed}, "
-            f"max_iterations={self._max_iterations} (without change)."
+            f"max_iterations={self._max_iterations} (without change), "
+            f"engine={self._engine}, init={self._init}, n_init={self._n_init}, "
+            f"color_space={self._color_space}."
         )
 
+        self._truncated = False
+        if self._max_time is not None:
+            self._deadline = time.time() + self._max_time
+
+        if self._engine == "naive" and weights is not None:
+            raise ValueError("Weighted pixels are not supported by the naive engine")
+
+        if self._n_init > 1:
+            return self._fitRestarts(pixels, weights)
+
+        if self._engine != "naive":
+            return self._fitArray(self._toArray(pixels), weights)
+
         # initialize centroids by randomly picking pixels
-        random.seed(self._random_seed)
-        self._centroids = random.sample(pixels, self._n_clusters)
+        if self._init == "random" and self._initial_centroids is None:
+            random.seed(self._random_seed)
+            self._centroids = random.sample(pixels, self._n_clusters)
+        else:
+            self._centroids = [
+                Color(*c)
+                for c in self._initialCentroids(self._toArray(pixels)).tolist()
+            ]
         self._pixels = pixels
+        self._total_weight = len(pixels)
+        if self._metrics is not None:
+            self._metrics.add("points", len(pixels))
         # cound the number of iterations for logging purposes
         iteration = 0
         last_avg_dist = None
         unchanged_iterations = 0
+        best = None
 
         while True:
-            logging.info(f"Iteration {iteration}...")
+            logging.info("Iteration %d...", iteration)
             self._invalidateAvgDist()
             self._clusters = [[] for _ in range(self._n_clusters)]
 
@@ -85,27 +276,715 @@ class KMeans:
                 self._clusters[dist.index(min(dist))].append(pixel)
 
             logging.info("Calculating new centroids...")
-            new_centroids = [self._centroid(cluster) for cluster in self._clusters]
+            # empty clusters keep their previous centroid
+            new_centroids = [
+                self._centroid(cluster) if cluster else centroid
+                for centroid, cluster in zip(self._centroids, self._clusters)
+            ]
+            shift = max(
+                self._sq_distance(new, old) ** 0.5
+                for new, old in zip(new_centroids, self._centroids)
+            )
             self._centroids = new_centroids
 
-            logging.info(f"Average distance: {self._toFixed(self.avg_dist)}")
+            # the average distance is only computed once per iteration
+            # and the messages are only formatted if they are logged
+            avg_dist = self.avg_dist
+            logging.info("Average distance: %.3f", avg_dist)
+            if self._metrics is not None:
+                self._metrics.iteration(self.inertia)
+            if best is None or avg_dist < best[0]:
+                best = avg_dist, self._centroids, self._clusters
+
+            if avg_dist < self._min_dist:
+                logging.info("Fitting completed.")
+                break
+
+            if shift <= self._tol:
+                # the next iterations would assign the pixels to (almost)
+                # the same centroids, as happens when starting from a similar
+                # palette
+                logging.info("Centroids unchanged, fitting completed.")
+                break
+
+            if self._toFixed(avg_dist) == last_avg_dist:
+                unchanged_iterations += 1
+                if unchanged_iterations >= self._max_iterations:
+                    logging.info("Fitting completed.")
+                    break
+
+            if self._limitReached(iteration):
+                # the clusters are rebuilt at each iteration, so the best ones
+                # are still valid
+                self._avg_dist, self._centroids, self._clusters = best
+                break
+
+            last_avg_dist = self._toFixed(avg_dist)
+            logging.info("Iteration %d completed.", iteration)
+            iteration += 1
+
+        return self
+
+    def _limitReached(self, iteration: int) -> bool:
+        # check if the fit must stop after an iteration, truncating it
+        if (
+            self._max_total_iterations is not None
+            and iteration + 1 >= self._max_total_iterations
+        ):
+            logging.warning(
+                f"Fit truncated after {iteration + 1} iterations, "
+                "keeping the best centroids"
+            )
+        elif self._deadline is not None and time.time() >= self._deadline:
+            logging.warning(
+                f"Fit truncated by the time limit after {iteration + 1} "
+                "iterations, keeping the best centroids"
+            )
+        else:
+            return False
+
+        self._truncated = True
+        if self._metrics is not None:
+            self._metrics.add("truncated_fits", 1)
+        return True
+
+    def _fitRestarts(
+        self, pixels: list[Color] | np.ndarray, weights: np.ndarray = None
+    ) -> KMeans:
+        # each restart is a single fit with a consecutive seed
+        runs = [
+            KMeans(
+                n_clusters=self._n_clusters,
+                random_seed=self._random_seed + i,
+                min_dist=self._min_dist,
+                max_iterations=self._max_iterations,
+                engine=self._engine,
+                init=self._init,
+                color_space=self._color_space,
+                max_total_iterations=self._max_total_iterations,
+                tol=self._tol,
+            )
+            for i in range(self._n_init)
+        ]
+        for run in runs:
+            run._deadline = self._deadline
+
+        if self._n_jobs > 1:
+            # multiprocessing is slow to import and only needed here
+            from concurrent.futures import ProcessPoolExecutor
+
+            logging.info(f"Running {self._n_init} fits on {self._n_jobs} processes")
+            with ProcessPoolExecutor(max_workers=self._n_jobs) as executor:
+                fitted = list(
+                    executor.map(_fit_model, runs, repeat(pixels), repeat(weights))
+                )
+        else:
+            fitted = []
+            for run in runs:
+                if fitted and self._deadline is not None:
+                    if time.time() >= self._deadline:
+                        logging.warning(
+                            f"Time limit reached, skipping {len(runs) - len(fitted)} "
+                            "fits"
+                        )
+                        break
+                fitted.append(run.fit(pixels, weights))
+
+        best = min(fitted, key=lambda k: k.inertia)
+        logging.info(
+            f"Best fit: random_seed={best._random_seed}, "
+            f"inertia={self._toFixed(best.inertia)}"
+        )
+        # adopt the fitted state of the best run, the pixels are not
+        # sent back by the worker processes
+        state = best.__getstate__()
+        for key in ("_n_init", "_n_jobs", "_max_time"):
+            state.pop(key)
+        self.__dict__.update(state)
+        self._truncated = len(fitted) < len(runs) or any(k.truncated for k in fitted)
+        if self._engine != "naive":
+            self._points = self._toArray(pixels)
+            self._weights = weights
+        else:
+            self._pixels = pixels
+
+        return self
+
+    def _fitArray(self, points: np.ndarray, weights: np.ndarray = None) -> KMeans:
+        self._points = points
+        self._weights = weights
+        points = self._toSpace(points)
+        if weights is None:
+            total_weight = len(points)
+        else:
+            total_weight = int(weights.sum())
+        self._total_weight = total_weight
+        if self._metrics is not None:
+            self._metrics.add("points", len(points))
+        self._centroid_array = self._initialCentroids(points, weights)
+        self._bounds = None
+        self._bounded_points = self._bounded_stats = None
+        iteration = 0
+        last_avg_dist = None
+        unchanged_iterations = 0
+        best = None
 
-            if self.avg_dist < self._min_dist:
+        while True:
+            logging.info("Iteration %d...", iteration)
+            self._invalidateAvgDist()
+            self._clusters = None
+
+            logging.info("Assigning pixels to clusters...")
+            if self._engine == "hamerly":
+                self._labels, sums, sq_sums, counts = self._assignBounded(
+                    points, weights
+                )
+            else:
+                self._labels, sums, sq_sums, counts = self._assign(points, weights)
+
+            logging.info("Calculating new centroids...")
+            # empty clusters keep their previous centroid
+            filled = counts > 0
+            means = sums[filled] / counts[filled, None]
+            if self._color_space == "rgb":
+                means = np.floor(means)
+            previous = self._centroid_array.copy()
+            self._centroid_array[filled] = means
+            shift = np.sqrt(
+                ((self._centroid_array - previous).astype(np.float64) ** 2)
+                .sum(axis=1)
+                .max()
+            )
+
+            self._avg_dist = self._clusterAvgDist(sums, sq_sums, counts, total_weight)
+
+            # the average distance is only computed once per iteration
+            # and the messages are only formatted if they are logged
+            avg_dist = self.avg_dist
+            logging.info("Average distance: %.3f", avg_dist)
+            if self._metrics is not None:
+                self._metrics.iteration(self.inertia)
+            if best is None or avg_dist < best[0]:
+                best = avg_dist, self._centroid_array.copy()
+
+            if avg_dist < self._min_dist:
                 logging.info("Fitting completed.")
                 break
 
-            if self._toFixed(self.avg_dist) == last_avg_dist:
+            if shift <= self._tol:
+                # the next iterations would assign the pixels to (almost)
+                # the same centroids, as happens when starting from a similar
+                # palette
+                logging.info("Centroids unchanged, fitting completed.")
+                break
+
+            if self._toFixed(avg_dist) == last_avg_dist:
                 unchanged_iterations += 1
                 if unchanged_iterations >= self._max_iterations:
                     logging.info("Fitting completed.")
                     break
 
-            last_avg_dist = self._toFixed(self.avg_dist)
-            logging.info(f"Iteration {iteration} completed.")
+            if self._limitReached(iteration):
+                if best[0] < avg_dist:
+                    # the labels are only kept for the last iteration,
+                    # the points are assigned again to the best centroids
+                    self._centroid_array = best[1]
+                    self._labels, sums, sq_sums, counts = self._assign(points, weights)
+                    self._avg_dist = self._clusterAvgDist(
+                        sums, sq_sums, counts, total_weight
+                    )
+                break
+
+            last_avg_dist = self._toFixed(avg_dist)
+            logging.info("Iteration %d completed.", iteration)
             iteration += 1
 
+        self._bounds = None
+        self._bounded_points = self._bounded_stats = None
+        self._centroids = self._toColors(self._centroid_array)
         return self
 
+    def _clusterAvgDist(
+        self,
+        sums: np.ndarray,
+        sq_sums: np.ndarray,
+        counts: np.ndarray,
+        total_weight: float,
+    ) -> float:
+        # squared distance between every pixel and the current centroid of
+        # its cluster, expanded so that no per-pixel pass is needed
+        centroids = self._centroid_array.astype(np.float64)
+        sq_dist = (
+            sq_sums.sum()
+            - 2 * (centroids * sums).sum()
+            + (counts * (centroids**2).sum(axis=1)).sum()
+        )
+        return (max(float(sq_dist), 0) / total_weight) ** 0.5
+
+    @timed("fit")
+    def partial_fit(
+        self, batch: list[Color] | np.ndarray, weights: np.ndarray = None
+    ) -> KMeans:
+        """Update the KMeans model with a mini-batch of pixels (array engines only).
+
+        The centroids are initialized on the first batch, then each centroid \
+            moves towards the mean of its pixels in the batch with a learning \
+            rate that decays with the number of pixels it has already seen. \
+            The average distance is smoothed across batches.
+
+        Args:
+            batch (list[Color] | np.ndarray): list of Color objects or \
+                Nx3 array of RGB values
+            weights (np.ndarray, optional): number of occurrences of each pixel. \
+                Defaults to None.
+
+        Returns:
+            KMeans
+        """
+        if self._engine == "naive":
+            raise ValueError("Mini-batch fitting is not supported by the naive engine")
+
+        rgb_points = self._toArray(batch)
+        points = self._toSpace(rgb_points)
+        if self._centroid_array is None:
+            logging.info(
+                "Starting mini-batch fit of KMeans model. "
+                f"n_clusters={self._n_clusters}, min_dist={self._min_dist}, "
+                f"random_seed={self._random_seed}, "
+                f"max_iterations={self._max_iterations} (without change), "
+                f"init={self._init}."
+            )
+            self._centroid_array = self._initialCentroids(points, weights).astype(
+                np.float64
+            )
+            self._seen = np.zeros(self._n_clusters)
+            self._total_weight = 0
+            self._batches = 0
+            self._unchanged_batches = 0
+
+        self._labels, sums, sq_sums, counts = self._assign(points, weights)
+        previous = self._centroid_array.copy()
+
+        # average distance of the batch to the centroids it was assigned to
+        sq_dist = (
+            sq_sums.sum()
+            - 2 * (previous * sums).sum()
+            + (counts * (previous**2).sum(axis=1)).sum()
+        )
+        batch_avg_dist = (max(float(sq_dist), 0) / counts.sum()) ** 0.5
+        if self._avg_dist is None:
+            self._avg_dist = batch_avg_dist
+        else:
+            self._avg_dist += self._batch_smoothing * (batch_avg_dist - self._avg_dist)
+
+        filled = counts > 0
+        self._seen += counts
+        rate = counts[filled] / self._seen[filled]
+        self._centroid_array[filled] += rate[:, None] * (
+            sums[filled] / counts[filled, None] - previous[filled]
+        )
+
+        shift = np.sqrt(((self._centroid_array - previous) ** 2).sum(axis=1).max())
+        if shift < self._batch_shift_tol:
+            self._unchanged_batches += 1
+        else:
+            self._unchanged_batches = 0
+
+        self._total_weight += counts.sum()
+        self._batches += 1
+        if self._metrics is not None:
+            self._metrics.add("points", len(points))
+            self._metrics.iteration(max(float(sq_dist), 0))
+        self._points = rgb_points
+        self._weights = weights
+        self._clusters = None
+        self._centroids = self._toColors(self._centroid_array)
+        logging.info(
+            "Batch %d: average distance %.3f, max centroid shift %.3f",
+            self._batches,
+            self.avg_dist,
+            shift,
+        )
+        return self
+
+    @property
+    def converged(self) -> bool:
+        """Check if the mini-batch fit has converged.
+
+        The fit is converged when the smoothed average distance is lower \
+            than min_dist or the centroids have not changed for max_iterations \
+            consecutive batches.
+
+        Returns:
+            bool
+        """
+        if self._centroid_array is None:
+            return False
+
+        return (
+            self.avg_dist < self._min_dist
+            or self._unchanged_batches >= self._max_iterations
+        )
+
+    @timed("assign")
+    def _assign(
+        self, points: np.ndarray, weights: np.ndarray = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # assign each point to its closest centroid, chunk by chunk to keep
+        # the distance matrix small, and accumulate the (weighted) cluster
+        # statistics. In the rgb color space all the values are integers
+        # below 2**53 so float64 math is exact.
+        centroids, centroids_sq = self._distanceTerms()
+        if self._metrics is not None:
+            self._metrics.add("distances", len(points))
+
+        labels = np.empty(len(points), dtype=np.intp)
+        sums = np.zeros((self._n_clusters, 3))
+        sq_sums = np.zeros(self._n_clusters)
+        counts = np.zeros(self._n_clusters)
+
+        for start in range(0, len(points), self._chunk_size):
+            chunk = points[start : start + self._chunk_size].astype(np.float64)
+            chunk_sq = (chunk**2).sum(axis=1)
+            dist = self._chunkDistances(chunk, centroids, centroids_sq)
+            chunk_labels = dist.argmin(axis=1)
+            labels[start : start + len(chunk)] = chunk_labels
+
+            if weights is None:
+                chunk_weights = np.ones(len(chunk))
+            else:
+                chunk_weights = weights[start : start + self._chunk_size]
+                chunk = chunk * chunk_weights[:, None]
+                chunk_sq = chunk_sq * chunk_weights
+
+            counts += np.bincount(
+                chunk_labels, weights=chunk_weights, minlength=self._n_clusters
+            )
+            sq_sums += np.bincount(
+                chunk_labels, weights=chunk_sq, minlength=self._n_clusters
+            )
+            for channel in range(3):
+                sums[:, channel] += np.bincount(
+                    chunk_labels,
+                    weights=chunk[:, channel],
+                    minlength=self._n_clusters,
+                )
+
+        return labels, sums, sq_sums, counts
+
+    @timed("assign")
+    def _assignBounded(
+        self, points: np.ndarray, weights: np.ndarray = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Hamerly's algorithm: each point keeps an upper bound of the distance
+        # to its centroid and a lower bound of the distance to the second
+        # closest one. Only the points whose bounds overlap after the
+        # centroids moved need their distances computed again.
+        centroids = self._centroid_array.astype(np.float64)
+
+        if self._bounds is None:
+            # the points are converted once per fit, not once per iteration
+            float_points = points.astype(np.float64)
+            channels = [np.ascontiguousarray(float_points[:, c]) for c in range(3)]
+            points_sq = channels[0] ** 2 + channels[1] ** 2 + channels[2] ** 2
+            if weights is None:
+                weights = np.ones(len(points))
+            else:
+                weights = weights.astype(np.float64)
+            self._bounded_points = float_points, channels, points_sq, weights
+
+            upper = np.empty(len(points))
+            lower = np.empty(len(points))
+            self._labels = np.empty(len(points), dtype=np.intp)
+            candidates = np.arange(len(points))
+        else:
+            float_points, channels, points_sq, weights = self._bounded_points
+            upper, lower, previous = self._bounds
+            shift = np.sqrt(((centroids - previous) ** 2).sum(axis=1))
+            upper += shift[self._labels]
+            # the second closest centroid is any centroid but the assigned one
+            largest = shift.argmax()
+            other_shift = np.delete(shift, largest).max(initial=0)
+            lower -= np.where(self._labels == largest, other_shift, shift[largest])
+
+            # a point closer to its centroid than half the distance to any
+            # other centroid cannot change cluster
+            centroid_dist = np.sqrt(
+                ((centroids[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+            )
+            np.fill_diagonal(centroid_dist, np.inf)
+            bound = np.maximum(centroid_dist.min(axis=1)[self._labels] / 2, lower)
+
+            candidates = np.flatnonzero(upper + self._bounds_tol >= bound)
+            # tighten the upper bound before computing all the distances,
+            # channel by channel as summing along the rows of a Nx3 array is slow
+            candidate_labels = self._labels[candidates]
+            sq_dist = np.zeros(len(candidates))
+            for c in range(3):
+                diff = channels[c].take(candidates)
+                diff -= centroids[:, c].take(candidate_labels)
+                diff *= diff
+                sq_dist += diff
+            upper[candidates] = np.sqrt(sq_dist)
+            candidates = candidates[
+                upper[candidates] + self._bounds_tol >= bound[candidates]
+            ]
+
+        logging.info("Computing distances for %d pixels", len(candidates))
+        if self._metrics is not None:
+            self._metrics.add("distances", len(candidates))
+        float_centroids, centroids_sq = self._distanceTerms()
+        previous_labels = self._labels[candidates]
+        for start in range(0, len(candidates), self._chunk_size):
+            index = candidates[start : start + self._chunk_size]
+            rows = np.arange(len(index))
+            dist = self._chunkDistances(
+                float_points[index], float_centroids, centroids_sq
+            )
+            chunk_labels = dist.argmin(axis=1)
+            self._labels[index] = chunk_labels
+            # rounding can make the distance of a point lying on a centroid
+            # slightly negative in the lab color space
+            closest = dist[rows, chunk_labels] + points_sq[index]
+            upper[index] = np.sqrt(np.maximum(closest, 0))
+            if self._n_clusters > 1:
+                # the second smallest distance, cheaper than a partition
+                dist[rows, chunk_labels] = np.inf
+                second = dist.min(axis=1) + points_sq[index]
+                lower[index] = np.sqrt(np.maximum(second, 0))
+            else:
+                lower[index] = np.inf
+
+        self._bounds = (upper, lower, centroids)
+
+        if self._bounded_stats is None:
+            counts = np.bincount(
+                self._labels, weights=weights, minlength=self._n_clusters
+            )
+            sums = np.stack(
+                [
+                    np.bincount(
+                        self._labels,
+                        weights=channels[c] * weights,
+                        minlength=self._n_clusters,
+                    )
+                    for c in range(3)
+                ],
+                axis=1,
+            )
+            sq_sums = np.bincount(
+                self._labels, weights=points_sq * weights, minlength=self._n_clusters
+            )
+        else:
+            # only the points that changed cluster move their statistics,
+            # in the rgb color space the sums are integers and stay exact
+            sums, sq_sums, counts = self._bounded_stats
+            moved = self._labels[candidates] != previous_labels
+            index = candidates[moved]
+            for labels, sign in (
+                (previous_labels[moved], -1),
+                (self._labels[index], 1),
+            ):
+                moved_weights = sign * weights[index]
+                counts += np.bincount(
+                    labels, weights=moved_weights, minlength=self._n_clusters
+                )
+                sq_sums += np.bincount(
+                    labels,
+                    weights=points_sq[index] * moved_weights,
+                    minlength=self._n_clusters,
+                )
+                for c in range(3):
+                    sums[:, c] += np.bincount(
+                        labels,
+                        weights=channels[c][index] * moved_weights,
+                        minlength=self._n_clusters,
+                    )
+
+        self._bounded_stats = sums, sq_sums, counts
+        # the caller must not modify the statistics kept for the next iteration
+        return self._labels, sums.copy(), sq_sums.copy(), counts.copy()
+
+    @timed("init")
+    def _initialCentroids(
+        self, points: np.ndarray, weights: np.ndarray = None
+    ) -> np.ndarray:
+        if self._initial_centroids is not None:
+            return self._toSpace(self._initial_centroids).astype(
+                self._centroidType(points)
+            )
+
+        if self._init == "random":
+            # pick the same pixels as the naive engine:
+            # random.sample only depends on the size of the population
+            random.seed(self._random_seed)
+            if weights is None:
+                seeds = random.sample(range(len(points)), self._n_clusters)
+            else:
+                # each point is repeated as many times as its weight
+                cumulative = np.cumsum(weights)
+                seeds = np.searchsorted(
+                    cumulative,
+                    random.sample(range(int(cumulative[-1])), self._n_clusters),
+                    side="right",
+                )
+            return points[seeds].astype(self._centroidType(points))
+
+        rng = np.random.default_rng(self._random_seed)
+        if weights is None:
+            weights = np.ones(len(points))
+        else:
+            weights = weights.astype(np.float64)
+
+        if self._init == "k-means||":
+            points, weights = self._parallelCandidates(points, weights, rng)
+
+        return self._plusPlusCentroids(points, weights, rng)
+
+    def _plusPlusCentroids(
+        self, points: np.ndarray, weights: np.ndarray, rng: np.random.Generator
+    ) -> np.ndarray:
+        # greedy k-means++: each new centroid is the best of a few candidates
+        # drawn with probability proportional to their squared distance
+        n_trials = 2 + int(np.log(self._n_clusters))
+        first = self._weightedChoice(weights, 1, rng)
+        centroids = [points[first[0]]]
+        _, closest = self._closest(points, points[first])
+
+        for _ in range(1, self._n_clusters):
+            potential = weights * closest
+            if potential.sum() == 0:
+                # there are fewer distinct colors than clusters
+                potential = weights
+            candidates = self._weightedChoice(potential, n_trials, rng)
+
+            # potential of every candidate in a single pass over the points
+            candidate_points, candidate_sq = self._distanceTerms(points[candidates])
+            candidate_potential = np.zeros(n_trials)
+            for start in range(0, len(points), self._chunk_size):
+                chunk = points[start : start + self._chunk_size].astype(np.float64)
+                dist = self._chunkDistances(chunk, candidate_points, candidate_sq)
+                dist = dist + (chunk**2).sum(axis=1)[:, None]
+                chunk_closest = closest[start : start + self._chunk_size, None]
+                chunk_weights = weights[start : start + self._chunk_size, None]
+                candidate_potential += (
+                    chunk_weights * np.minimum(chunk_closest, dist)
+                ).sum(axis=0)
+
+            best = candidates[candidate_potential.argmin()]
+            centroids.append(points[best])
+            _, dist = self._closest(points, points[[best]])
+            np.minimum(closest, dist, out=closest)
+
+        return np.array(centroids, dtype=self._centroidType(points))
+
+    def _weightedChoice(
+        self, weights: np.ndarray, size: int, rng: np.random.Generator
+    ) -> np.ndarray:
+        # draw indices with probability proportional to their weight,
+        # cheaper than rng.choice which normalizes and validates the weights
+        cumulative = np.cumsum(weights)
+        return np.searchsorted(
+            cumulative, rng.random(size) * cumulative[-1], side="right"
+        ).clip(max=len(weights) - 1)
+
+    def _parallelCandidates(
+        self, points: np.ndarray, weights: np.ndarray, rng: np.random.Generator
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # k-means||: oversample candidates in a few rounds, then weight each
+        # of them by the pixels it is closest to
+        oversampling = 2 * self._n_clusters
+        candidates = self._weightedChoice(weights, 1, rng).tolist()
+        _, closest = self._closest(points, points[candidates])
+
+        for _ in range(self._parallel_init_rounds):
+            potential = weights * closest
+            if potential.sum() == 0:
+                break
+            probability = oversampling * potential / potential.sum()
+            picked = np.flatnonzero(rng.random(len(points)) < probability)
+            if len(picked) == 0:
+                continue
+
+            candidates.extend(picked.tolist())
+            _, dist = self._closest(points, points[picked])
+            closest = np.minimum(closest, dist)
+
+        candidate_points = points[candidates]
+        labels, _ = self._closest(points, candidate_points)
+        candidate_weights = np.bincount(
+            labels, weights=weights, minlength=len(candidate_points)
+        )
+        logging.info(f"Selected {len(candidate_points)} k-means|| candidates")
+        return candidate_points, candidate_weights
+
+    def _closest(
+        self, points: np.ndarray, centroids: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # index of and squared distance to the closest centroid of each point
+        centroids, centroids_sq = self._distanceTerms(centroids)
+        labels = np.empty(len(points), dtype=np.intp)
+        sq_dist = np.empty(len(points))
+
+        for start in range(0, len(points), self._chunk_size):
+            chunk = points[start : start + self._chunk_size].astype(np.float64)
+            dist = self._chunkDistances(chunk, centroids, centroids_sq)
+            chunk_labels = dist.argmin(axis=1)
+            labels[start : start + len(chunk)] = chunk_labels
+            sq_dist[start : start + len(chunk)] = np.maximum(
+                dist[np.arange(len(chunk)), chunk_labels] + (chunk**2).sum(axis=1), 0
+            )
+
+        return labels, sq_dist
+
+    def _distanceTerms(
+        self, centroids: np.ndarray = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # centroids and their squared norms in the precision of the distances
+        if centroids is None:
+            centroids = self._centroid_array
+        centroids = centroids.astype(self._dtype)
+        return centroids, (centroids.astype(np.float64) ** 2).sum(axis=1).astype(
+            self._dtype
+        )
+
+    def _chunkDistances(
+        self, chunk: np.ndarray, centroids: np.ndarray, centroids_sq: np.ndarray
+    ) -> np.ndarray:
+        # squared distances between the chunk and the centroids, minus the
+        # squared norm of each point which does not change the closest
+        # centroid. With 8 bit colors and integer centroids every term is an
+        # integer below 2**24, so float32 math is still exact.
+        dist = chunk.astype(self._dtype) @ centroids.T
+        dist *= -2
+        dist += centroids_sq
+        return dist
+
+    def _toSpace(self, points: np.ndarray) -> np.ndarray:
+        # coordinates of the RGB points in the clustering color space
+        if self._color_space == "lab":
+            return rgb_to_lab(points)
+        return points
+
+    def _toColors(self, centroids: np.ndarray) -> list[Color]:
+        # colors of the centroids, rounded to the closest RGB color
+        if self._color_space == "lab":
+            centroids = lab_to_rgb(centroids)
+        return [
+            Color(*c) for c in np.clip(np.rint(centroids), 0, 255).astype(int).tolist()
+        ]
+
+    def _centroidType(self, points: np.ndarray) -> type:
+        # RGB centroids are kept integer like the naive engine
+        if np.issubdtype(points.dtype, np.integer):
+            return np.int64
+        return np.float64
+
+    def _toArray(self, pixels: list[Color] | np.ndarray) -> np.ndarray:
+        if isinstance(pixels, np.ndarray):
+            return pixels.reshape(-1, 3)
+        return np.array([p.rgb for p in pixels], dtype=np.uint8).reshape(-1, 3)
+
     def _sq_distance(self, pixel: Color, centroid: list[float]) -> float:
         return sum((p - c) ** 2 for p, c in zip(pixel.rgb, centroid.rgb))
 
@@ -142,6 +1021,27 @@ class KMeans:
 
         return self._avg_dist
 
+    @property
+    def truncated(self) -> bool:
+        """Check if the last fit was stopped by max_total_iterations or max_time.
+
+        A truncated fit keeps the centroids with the lowest average distance \
+            found so far.
+
+        Returns:
+            bool
+        """
+        return self._truncated
+
+    @property
+    def inertia(self) -> float:
+        """Get the sum of the square distances between pixels and their centroids.
+
+        Returns:
+            float
+        """
+        return self.avg_dist**2 * self._total_weight
+
     @property
     def centroids(self) -> list[Color]:
         """Get the centroids of the clusters.
@@ -155,7 +1055,33 @@ class KMeans:
     def clusters(self) -> list[list[Color]]:
         """Get the clusters.
 
+        The array engines only store the label of each pixel, \
+            so the clusters are built on the first access. \
+            When fitting weighted pixels each color appears only once.
+
         Returns:
             list[list[Color]]
         """
+        if self._clusters is None and self._labels is not None:
+            self._clusters = [
+                [Color(*p) for p in self._points[self._labels == i].tolist()]
+                for i in range(self._n_clusters)
+            ]
+
         return self._clusters.copy()
+
+    @property
+    def labels(self) -> np.ndarray:
+        """Get the index of the cluster of each pixel (array engines only).
+
+        Returns:
+            np.ndarray
+        """
+        return self._labels
+
+
+def _fit_model(
+    model: KMeans, pixels: list[Color] | np.ndarray, weights: np.ndarray = None
+) -> KMeans:
+    # module level function so that it can be sent to worker processes
+    return model.fit(pixels, weights)
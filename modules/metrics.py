@@ -0,0 +1,136 @@
+"""Instrumentation module."""
+from __future__ import annotations
+
+import functools
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+
+class Metrics:
+    """Record of the time and resources spent extracting a palette.
+
+    The objects accepting a Metrics instance only record something if one \
+        is passed, so the instrumentation costs nothing when disabled.
+    """
+
+    def __init__(self, path: str = None, trace_memory: bool = False) -> Metrics:
+        """Initialize a Metrics object.
+
+        Args:
+            path (str, optional): Path of a JSON lines file, each call to write \
+                appends a record to it. Defaults to None.
+            trace_memory (bool, optional): Trace the peak memory allocated by \
+                Python and numpy. Slows down the extraction. Defaults to False.
+
+        Returns:
+            Metrics
+        """
+        self._path = path
+        self._trace_memory = trace_memory
+        self._phases = {}
+        self._counters = {}
+        self._inertia = []
+
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measure the wall time of a phase.
+
+        The time of phases with the same name is summed.
+
+        Args:
+            name (str): Name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._phases[name] = self._phases.get(name, 0) + elapsed
+
+    def add(self, name: str, value: int):
+        """Add a value to a counter.
+
+        Args:
+            name (str): Name of the counter.
+            value (int)
+        """
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def iteration(self, inertia: float):
+        """Record a KMeans iteration.
+
+        Args:
+            inertia (float): Sum of the square distances between the pixels \
+                and their centroids after the iteration.
+        """
+        self._inertia.append(inertia)
+
+    @property
+    def record(self) -> dict:
+        """Get the recorded metrics.
+
+        Returns:
+            dict: Wall time of each phase in seconds, number of KMeans \
+                iterations and inertia after each of them, counters \
+                and peak memory in bytes (None if not traced).
+        """
+        peak_memory = None
+        if self._trace_memory and tracemalloc.is_tracing():
+            peak_memory = tracemalloc.get_traced_memory()[1]
+
+        return {
+            "phases": self._phases.copy(),
+            "iterations": len(self._inertia),
+            "inertia": self._inertia.copy(),
+            **self._counters,
+            "peak_memory": peak_memory,
+        }
+
+    def write(self, **context) -> dict:
+        """Get the recorded metrics and append them to the JSON lines file.
+
+        Args:
+            context: Values added to the record, like the path of the image.
+
+        Returns:
+            dict
+        """
+        record = {**context, **self.record}
+        if self._path is not None:
+            with open(self._path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+        return record
+
+
+def timed(phase: str) -> Callable:
+    """Decorate a method to measure its wall time in the metrics of its object.
+
+    The object must store a Metrics instance or None in its _metrics attribute.
+
+    Args:
+        phase (str): Name of the phase.
+
+    Returns:
+        Callable
+    """
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._metrics is None:
+                return method(self, *args, **kwargs)
+            with self._metrics.phase(phase):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
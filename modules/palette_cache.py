@@ -0,0 +1,135 @@
+"""Palette cache module."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+
+from .color import Color
+
+
+class PaletteCache:
+    """Content-addressed on-disk cache of extracted palettes.
+
+    Each palette is stored in a JSON file named after the hash of the image \
+        bytes and of the extraction parameters. When the cache grows over its \
+        maximum size, the least recently used palettes are removed.
+    """
+
+    _read_size: int = 2**20
+
+    def __init__(
+        self, folder: str = None, max_size: int = 16 * 2**20
+    ) -> PaletteCache:
+        """Initialize a PaletteCache object.
+
+        Args:
+            folder (str, optional): Folder containing the cached palettes. \
+                Defaults to ~/.cache/image-palette/.
+            max_size (int, optional): Maximum size of the cache in bytes. \
+                Defaults to 16 MiB.
+
+        Returns:
+            PaletteCache
+        """
+        if folder is None:
+            folder = os.path.join(os.path.expanduser("~"), ".cache", "image-palette")
+
+        self._folder = pathlib.Path(folder)
+        self._max_size = max_size
+
+    def key(self, path: str, params: dict) -> str:
+        """Get the key of the palette of an image.
+
+        Args:
+            path (str): Path to the image.
+            params (dict): Parameters of the extraction, must be JSON serializable.
+
+        Returns:
+            str
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(self._read_size):
+                digest.update(chunk)
+
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> list[Color] | None:
+        """Get a palette from the cache.
+
+        Args:
+            key (str)
+
+        Returns:
+            list[Color] | None: None if the palette is not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # the modification time marks the last use of the palette
+        path.touch()
+        logging.info(f"Palette found in cache. Path: {path}")
+        return [Color(*c) for c in data["rgb"]]
+
+    def put(self, key: str, colors: list[Color], params: dict = None):
+        """Store a palette in the cache, then evict the least recently used ones.
+
+        Args:
+            key (str)
+            colors (list[Color])
+            params (dict, optional): Parameters of the extraction, \
+                stored for reference. Defaults to None.
+        """
+        self._folder.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        # write to a temporary file first so that readers never see
+        # a partially written palette
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump({"rgb": [c.rgb for c in colors], "params": params}, f)
+        os.replace(temp_path, path)
+
+        logging.info(f"Palette saved in cache. Path: {path}")
+        self._evict()
+
+    def clear(self):
+        """Remove all the palettes from the cache."""
+        for path in self._entries():
+            path.unlink(missing_ok=True)
+
+        logging.info(f"Cache cleared. Path: {self._folder}")
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self._folder / f"{key}.json"
+
+    def _entries(self) -> list[pathlib.Path]:
+        if not self._folder.is_dir():
+            return []
+        return list(self._folder.glob("*.json"))
+
+    def _evict(self):
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        # remove the least recently used palettes first
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total_size <= self._max_size:
+                break
+
+            path.unlink(missing_ok=True)
+            total_size -= size
+            logging.info(f"Palette evicted from cache. Path: {path}")
@@ -2,31 +2,88 @@
 
 import json
 import logging
+import os
 import pathlib
+from concurrent.futures import Executor
 
-from PIL import Image, ImageDraw
+import numpy as np
+from PIL import Image
 
 from .color import Color
 from .kmeans import KMeans
+from .metrics import Metrics, timed
+from .colorspace import rgb_to_lab
+from .palette_cache import PaletteCache
+from .palette_size import (
+    CRITERIA,
+    elbow,
+    nearest_labels,
+    pairwise_distances,
+    sample_points,
+    silhouette,
+)
+from .pixels import color_histogram, read_pixels
+from .quantizer import QUANTIZERS, KMeansQuantizer
 from .position import Position
-from .terminal import format_table, Cell
+from .tiles import (
+    palette_deviation,
+    palette_inertia,
+    reduce_tiles,
+    tile_boxes,
+    tile_statistics,
+)
 
 
 class PaletteExtractor:
     """Palette extractor class."""
 
     _colors: list[Color] = None
+    _frame_colors: list[list[Color]] = None
+    _auto_scores: list[dict] = None
+    _tile_report: dict = None
+    _truncated: bool = False
     _resized_width: int = 1000
+    # the image is reduced with a box filter until it is this many times
+    # bigger than the target size, then resampled with the chosen filter
+    _reducing_gap: float = 3.0
+    # number of sampled pixels the silhouette of each palette size is computed
+    # on, comparing all their pairs
+    _silhouette_size: int = 1000
+    # file extension of the formats of the saved images
+    _image_formats: dict[str, str] = {"png": "png", "jpeg": "jpg", "webp": "webp"}
 
-    def __init__(self):
-        """Initialize the class."""
+    def __init__(self, metrics: Metrics = None, executor: Executor = None):
+        """Initialize the class.
+
+        Args:
+            metrics (Metrics, optional): Record of the time spent in each phase \
+                (load, extract, generate, incorporate, save), of the KMeans \
+                iterations and of the pixels processed. Defaults to None.
+            executor (Executor, optional): Executor encoding the saved images \
+                in the background, so that the save methods return immediately. \
+                Call waitSaved to wait until they are written. Defaults to None.
+        """
         self._colors = []
+        self._metrics = metrics
+        self._executor = executor
+        self._saves = []
+        self._outputs = []
 
     def _createFolder(self, path: str):
         """Create a folder if it doesn't exist; if it does, do nothing."""
         pathlib.Path(path).mkdir(parents=True, exist_ok=True)
 
-    def loadImage(self, path: str, palette_size: int = 5, resize: bool = False) -> None:
+    @timed("load")
+    def loadImage(
+        self,
+        path: str,
+        palette_size: int = 5,
+        resize: bool = False,
+        resize_width: int = None,
+        resize_megapixels: float = None,
+        resample: str = "bicubic",
+        low_memory: bool = False,
+    ) -> None:
         """Load an image.
 
         Args:
@@ -34,56 +91,771 @@ class PaletteExtractor:
             palette_size (int, optional): Numbers of colors to isolate.. Defaults to 5.
             resize (bool, optional): Resize the image to make the computation faster. \
              Defaults to False.
+            resize_width (int, optional): Width of the resized image. \
+                Defaults to 1000.
+            resize_megapixels (float, optional): Area of the resized image, \
+                in megapixels. If provided, it is used instead of resize_width. \
+                Defaults to None.
+            resample (str, optional): Resampling filter used to resize the image. \
+                One of "nearest", "box", "bilinear", "hamming", "bicubic", \
+                "lanczos". Defaults to "bicubic".
+            low_memory (bool, optional): Release the image once the colors \
+                are extracted, incorporatePalette decodes it again. \
+                The colors can only be extracted once. Defaults to False.
         """
         self._path = path
         self._palette_size = palette_size
+        self._low_memory = low_memory
         self._im = Image.open(self._path)
+        self._load_params = {
+            "palette_size": palette_size,
+            "resize": resize,
+            "resize_width": resize_width,
+            "resize_megapixels": resize_megapixels,
+            "resample": resample,
+        }
+
+        size = None
+        if resize:
+            size = self._resizedSize(
+                self._im.size,
+                resize_width or self._resized_width,
+                resize_megapixels,
+            )
+
+        if size is None:
+            # the image is only read, so it is the working image itself.
+            # It is decoded when its pixels are first needed
+            self._working_image = self._im
+            return
 
-        # create a copy of the image to work on
-        self._working_image = self._im.copy()
         # resize the image if it's too big
-        # you might miss some colors but the runtime will be way lower
-        if resize and self._im.width > self._resized_width:
-            new_width = self._resized_width
-            new_height = int(self._im.height / self._im.width * new_width)
-            self._working_image = self._working_image.resize((new_width, new_height))
+        # you might miss some colors but the runtime will be way lower.
+        # The working image is decoded separately so that JPEG files can be
+        # decoded directly at a reduced scale, and the remaining reduction
+        # is done with a fast box filter before the actual resampling
+        working_image = Image.open(self._path)
+        working_image.draft("RGB", size)
+        logging.info(f"Decoding image at {working_image.size} to resize it to {size}")
+        self._working_image = working_image.resize(
+            size,
+            resample=Image.Resampling[resample.upper()],
+            reducing_gap=self._reducing_gap,
+        )
+
+    def _resizedSize(
+        self,
+        size: tuple[int, int],
+        width: int,
+        megapixels: float = None,
+    ) -> tuple[int, int] | None:
+        """Get the size of the resized image, keeping its aspect ratio.
+
+        Args:
+            size (tuple[int, int]): Size of the original image.
+            width (int): Maximum width of the resized image.
+            megapixels (float, optional): Maximum area of the resized image. \
+                If provided, width is ignored. Defaults to None.
+
+        Returns:
+            tuple[int, int] | None: None if the image is already small enough.
+        """
+        old_width, old_height = size
+        if megapixels is not None:
+            scale = (megapixels * 1_000_000 / (old_width * old_height)) ** 0.5
+            if scale >= 1:
+                return None
+            return max(1, int(old_width * scale)), max(1, int(old_height * scale))
 
-    def extractColors(self, seed: int = None, min_dist: int = 25, max_iter: int = 5):
+        if old_width <= width:
+            return None
+        return width, max(1, int(old_height / old_width * width))
+
+    @timed("extract")
+    def extractColors(
+        self,
+        seed: int = None,
+        method: str = "kmeans",
+        min_dist: int = 25,
+        max_iter: int = 5,
+        engine: str = "numpy",
+        histogram: bool = False,
+        init: str = "random",
+        n_init: int = 1,
+        n_jobs: int = 1,
+        batch_size: int = None,
+        max_batches: int = 1000,
+        color_space: str = "rgb",
+        initial_palette: list[Color] | str = None,
+        cache: PaletteCache = None,
+        max_total_iter: int = None,
+        tol: float = 0,
+        max_time: float = None,
+        sample: str = None,
+        sample_size: int = None,
+        sample_error: float = None,
+        refine: bool = False,
+    ) -> bool:
         """Extract the colors from the image.
 
         Args:
             seed (int, optional): Seed to initialize the KMeans algorithm. \
                 If none is provided, the algorithm will use the current time.
+            method (str, optional): Quantization algorithm, "kmeans", "median-cut", \
+                "octree" or "pillow" (the median cut implemented in C by Pillow). \
+                The other arguments only apply to "kmeans". Defaults to "kmeans".
             min_dist (int, optional): Minimum average distance between the centroids \
-                and each pixel. Defaults to 25.
+                and each pixel, in the units of color_space (see \
+                colorspace.scale_distance to convert RGB distances). \
+                Defaults to 25.
             max_iter (int, optional): Maximum number of iterations without change \
                 in objective function. Defaults to 5.
+            engine (str, optional): KMeans engine, "naive", "numpy" or "hamerly". \
+                All return the same colors for the same seed, "hamerly" skips \
+                most distance computations, which only pays off on fits \
+                with many iterations. Defaults to "numpy".
+            histogram (bool, optional): Cluster the unique colors of the image \
+                weighted by their number of occurrences instead of every pixel. \
+                Much faster on real images, requires the numpy engine. \
+                Defaults to False.
+            init (str, optional): Initialization of the centroids, \
+                "random", "k-means++" or "k-means||". Defaults to "random".
+            n_init (int, optional): Number of KMeans runs with different seeds, \
+                the best one is kept. Defaults to 1.
+            n_jobs (int, optional): Number of processes running the KMeans runs. \
+                If None, all the cores are used. Defaults to 1.
+            batch_size (int, optional): If provided, the KMeans model is fitted \
+                on random batches of this many pixels until it converges, \
+                so that only the sampled pixels are copied instead of all \
+                of them. The decoded image is still held in memory. \
+                Defaults to None.
+            max_batches (int, optional): Maximum number of batches used \
+                in the mini-batch mode. Defaults to 1000.
+            color_space (str, optional): Color space the pixels are clustered in, \
+                "rgb" or "lab". In CIELAB the distances match the perceived \
+                difference between colors, min_dist is measured in the same \
+                space. Not supported by the naive engine. Defaults to "rgb".
+            initial_palette (list[Color] | str, optional): Colors, or path \
+                to a palette JSON file, the KMeans centroids start from \
+                instead of the init method. The palette of a similar image \
+                converges in a few iterations, and the extracted colors keep \
+                the order of the initial ones. It must have as many colors \
+                as the palette size. Defaults to None.
+            cache (PaletteCache, optional): Cache of the extracted palettes. \
+                If the palette of the same image with the same parameters \
+                has already been extracted, it is loaded from the cache. \
+                KMeans palettes are only cached if a seed or an initial \
+                palette is provided. Defaults to None.
+            max_total_iter (int, optional): Maximum number of KMeans iterations, \
+                changed or not. Defaults to None.
+            tol (float, optional): The KMeans fit is completed when no color \
+                moves farther than this distance in an iteration. Defaults to 0.
+            max_time (float, optional): Maximum duration of the KMeans fit \
+                in seconds. Not supported in the mini-batch mode, \
+                bounded by max_batches. Defaults to None.
+            sample (str, optional): If provided, the KMeans model is fitted \
+                on a random sample of the pixels of the image, at full \
+                resolution, drawn with the "uniform", "stratified" (one pixel \
+                in each cell of a grid) or "reservoir" (a single pass over \
+                every pixel) method. Defaults to None.
+            sample_size (int, optional): Number of sampled pixels. \
+                Defaults to 100000, or 20000 for the first sample if \
+                sample_error is provided.
+            sample_error (float, optional): Target standard error of the \
+                colors, in the clustering color space. The sample is enlarged \
+                until the error estimated on the first one is reached. \
+                Defaults to None.
+            refine (bool, optional): Refine the colors found on the sample \
+                with a pass over all the pixels, assigning each of them to \
+                the closest color and moving the colors to the mean of their \
+                pixels. Defaults to False.
+
+        Returns:
+            bool: True if the fit was stopped by max_total_iter or max_time \
+                before converging, the colors are the best found so far.
         """
         # start extracting the colors
         logging.info("Starting color extractions")
-        pixels = self._working_image.load()
-        # need to convert to list the list of lists
-        pixels_list = [
-            Color(*pixels[x, y])
-            for x in range(self._working_image.width)
-            for y in range(self._working_image.height)
-        ]
-        # run the KMeans algorithm
+
+        if self._working_image is None:
+            raise ValueError("The image has been released, load it again")
+
+        if method not in QUANTIZERS:
+            raise ValueError(f"Method must be one of {', '.join(QUANTIZERS)}")
+
+        self._frame_colors = None
+        self._auto_scores = None
+        self._tile_report = None
+        self._truncated = False
+
+        if initial_palette is not None and method != "kmeans":
+            raise ValueError("An initial palette can only be used by the kmeans method")
+
+        if sample is not None and method != "kmeans":
+            raise ValueError("Only the kmeans method can sample the pixels")
+
+        if isinstance(initial_palette, str):
+            initial_palette = self._readPaletteJSON(initial_palette)
+
+        key = None
+        if cache is not None and not (
+            seed is not None or method != "kmeans" or initial_palette is not None
+        ):
+            logging.warning(
+                "The palette is not cached: KMeans needs a seed or an initial palette"
+            )
+        elif cache is not None:
+            params = {
+                **self._load_params,
+                "method": method,
+                "seed": seed,
+                "min_dist": min_dist,
+                "max_iter": max_iter,
+                "engine": engine,
+                "histogram": histogram,
+                "init": init,
+                "n_init": n_init,
+                "batch_size": batch_size,
+                "max_batches": max_batches,
+                "color_space": color_space,
+                "initial_palette": (
+                    [c.rgb for c in initial_palette] if initial_palette else None
+                ),
+                "max_total_iter": max_total_iter,
+                "tol": tol,
+                "sample": sample,
+                "sample_size": sample_size,
+                "sample_error": sample_error,
+                "refine": refine,
+            }
+            key = cache.key(self._path, params)
+            colors = cache.get(key)
+            if colors is not None:
+                self._colors = colors
+                logging.info("Colors loaded from cache")
+                if self._metrics is not None:
+                    self._metrics.add("cache_hits", 1)
+                if self._low_memory:
+                    self._releaseImage()
+                return False
+
+        if self._metrics is not None:
+            self._metrics.add(
+                "pixels", self._working_image.width * self._working_image.height
+            )
+
+        if method == "kmeans":
+            quantizer = KMeansQuantizer(
+                n_colors=self._palette_size,
+                seed=seed,
+                min_dist=min_dist,
+                max_iter=max_iter,
+                engine=engine,
+                histogram=histogram,
+                init=init,
+                n_init=n_init,
+                n_jobs=n_jobs,
+                batch_size=batch_size,
+                max_batches=max_batches,
+                color_space=color_space,
+                initial_centroids=initial_palette,
+                metrics=self._metrics,
+                max_total_iter=max_total_iter,
+                tol=tol,
+                max_time=max_time,
+                sample=sample,
+                sample_size=sample_size,
+                sample_error=sample_error,
+                refine=refine,
+            )
+        else:
+            quantizer = QUANTIZERS[method](
+                n_colors=self._palette_size, metrics=self._metrics
+            )
+
+        self._colors = quantizer.quantize(self._working_image)
+        self._truncated = quantizer.truncated
+        if initial_palette is None:
+            self._sortColors()
+        else:
+            # each centroid replaces the initial color it started from
+            logging.info("Colors extracted")
+        if key is not None and not self._truncated:
+            # the colors of a truncated fit depend on the time it took
+            cache.put(key, self._colors, params)
+        if self._low_memory:
+            self._releaseImage()
+
+        return self._truncated
+
+    def _releaseImage(self):
+        """Free the decoded image and the working image."""
+        logging.info("Releasing the image")
+        self._im.close()
+        self._im = None
+        self._working_image = None
+
+    @timed("extract")
+    def extractAutoColors(
+        self,
+        min_colors: int = 2,
+        max_colors: int = 10,
+        criterion: str = "silhouette",
+        seed: int = None,
+        min_dist: int = 25,
+        max_iter: int = 5,
+        engine: str = "numpy",
+        init: str = "random",
+        color_space: str = "rgb",
+        sample_size: int = 20000,
+    ) -> list[dict]:
+        """Extract the colors, choosing the size of the palette automatically.
+
+        The pixels are read and counted once. A random sample of them is \
+            clustered with the KMeans algorithm for every palette size \
+            in the range, each size starting from the colors of the previous \
+            one plus the color contributing the most to the inertia. \
+            Only the chosen size is then fitted on all the pixels, \
+            starting from the colors found on the sample. \
+            See extractColors for the description of the other arguments.
+
+        Args:
+            min_colors (int, optional): Smallest palette size, at least 2. \
+                Defaults to 2.
+            max_colors (int, optional): Largest palette size. Defaults to 10.
+            criterion (str, optional): "silhouette" chooses the size with the \
+                highest mean silhouette, "elbow" the size after which the \
+                inertia decreases slowly. Defaults to "silhouette".
+            sample_size (int, optional): Number of pixels the palette sizes \
+                are compared on. Defaults to 20000.
+
+        Returns:
+            list[dict]: Palette size, inertia and silhouette on the sample \
+                of each size.
+        """
+        if self._working_image is None:
+            raise ValueError("The image has been released, load it again")
+
+        if criterion not in CRITERIA:
+            raise ValueError(f"Criterion must be one of {', '.join(CRITERIA)}")
+
+        if not 2 <= min_colors <= max_colors:
+            raise ValueError(
+                "The palette sizes must be at least 2 and min_colors must not "
+                "be greater than max_colors"
+            )
+
+        logging.info(
+            f"Starting color extraction of {min_colors} to {max_colors} colors"
+        )
+        self._frame_colors = None
+        self._tile_report = None
+        self._truncated = False
+
+        colors, counts = color_histogram(read_pixels(self._working_image))
+        if self._metrics is not None:
+            self._metrics.add("pixels", int(counts.sum()))
+
+        def toSpace(rgb: np.ndarray) -> np.ndarray:
+            # coordinates of RGB colors in the clustering color space
+            if color_space == "lab":
+                return rgb_to_lab(rgb)
+            return rgb.astype(np.float64)
+
+        kmeans_params = {
+            "random_seed": seed,
+            "min_dist": min_dist,
+            "max_iterations": max_iter,
+            # the histograms need an array engine
+            "engine": "numpy" if engine == "naive" else engine,
+            "init": init,
+            "color_space": color_space,
+            "metrics": self._metrics,
+        }
+        sample_colors, sample_counts = color_histogram(
+            sample_points(colors, counts, sample_size, seed)
+        )
+        sample_points_space = toSpace(sample_colors)
+        # the silhouette compares all the pairs of a smaller sample
+        silhouette_points = toSpace(
+            sample_points(sample_colors, sample_counts, self._silhouette_size, seed)
+        )
+        distances = pairwise_distances(silhouette_points)
+
+        scores = []
+        sample_centroids = {}
+        initial_centroids = None
+        for size in range(min_colors, max_colors + 1):
+            kmeans = KMeans(
+                n_clusters=size, initial_centroids=initial_centroids, **kmeans_params
+            ).fit(sample_colors, weights=sample_counts)
+
+            centroids = np.array([c.rgb for c in kmeans.centroids], dtype=np.uint8)
+            sample_centroids[size] = centroids
+            labels = nearest_labels(silhouette_points, toSpace(centroids))
+            scores.append(
+                {
+                    "palette_size": size,
+                    "inertia": kmeans.inertia,
+                    "silhouette": silhouette(distances, labels),
+                }
+            )
+            logging.info(
+                f"{size} colors: inertia {scores[-1]['inertia']:.1f}, "
+                f"silhouette {scores[-1]['silhouette']:.3f}"
+            )
+
+            # the next size adds the color with the largest share of the inertia
+            sq_dist = (
+                (sample_points_space - toSpace(centroids)[kmeans.labels]) ** 2
+            ).sum(axis=1)
+            farthest = sample_colors[np.argmax(sample_counts * sq_dist)]
+            initial_centroids = np.vstack([centroids, farthest])
+
+        if criterion == "silhouette":
+            best = max(scores, key=lambda s: s["silhouette"])["palette_size"]
+        else:
+            best = elbow(
+                [s["palette_size"] for s in scores], [s["inertia"] for s in scores]
+            )
+        logging.info(f"Chosen palette size: {best}")
+
+        self._palette_size = best
+        self._colors = (
+            KMeans(
+                n_clusters=best,
+                initial_centroids=sample_centroids[best],
+                **kmeans_params,
+            )
+            .fit(colors, weights=counts)
+            .centroids
+        )
+        self._auto_scores = scores
+        self._sortColors()
+        if self._low_memory:
+            self._releaseImage()
+
+        return scores
+
+    @timed("extract")
+    def extractTiledColors(
+        self,
+        tile_size: int = 512,
+        tile_colors: int = None,
+        refine_iterations: int = 1,
+        n_jobs: int = 1,
+        compare: bool = False,
+        seed: int = None,
+        min_dist: int = 25,
+        max_iter: int = 5,
+        engine: str = "numpy",
+        init: str = "random",
+        color_space: str = "rgb",
+    ) -> dict:
+        """Extract the colors, clustering each tile of the image on its own.
+
+        Each tile is clustered with the KMeans algorithm and summarized by \
+            the statistics of its clusters, that are merged into the palette \
+            of the whole image (see the tiles module). Each refinement assigns \
+            the pixels of every tile to the merged colors and moves them to \
+            the mean of their pixels, like an iteration of the KMeans \
+            algorithm on the whole image. The tiles are processed by n_jobs \
+            processes, use palette-tiles.py to split them across machines. \
+            See extractColors for the description of the other arguments.
+
+        Args:
+            tile_size (int, optional): Side of the tiles, in pixels. \
+                Defaults to 512.
+            tile_colors (int, optional): Number of clusters of each tile. \
+                Defaults to twice the palette size.
+            refine_iterations (int, optional): Number of refinements of the \
+                merged colors. Defaults to 1.
+            n_jobs (int, optional): Number of processes clustering the tiles. \
+                If None, all the cores are used. Defaults to 1.
+            compare (bool, optional): Also extract the colors from the whole \
+                image at once and report how far the tiled palette is. \
+                Defaults to False.
+
+        Returns:
+            dict: Number of tiles and inertia of the palette. If compare is \
+                set, inertia of the palette extracted from the whole image, \
+                relative inertia deviation and largest distance between \
+                a tiled color and the closest color of the whole image palette.
+        """
+        if self._working_image is None:
+            raise ValueError("The image has been released, load it again")
+
+        if refine_iterations < 0:
+            raise ValueError("The number of refinements must not be negative")
+
+        boxes = tile_boxes(self._working_image.size, tile_size)
+        logging.info(f"Starting color extraction of {len(boxes)} tiles")
+        self._frame_colors = None
+        self._auto_scores = None
+        self._truncated = False
+        if self._metrics is not None:
+            self._metrics.add(
+                "pixels", self._working_image.width * self._working_image.height
+            )
+
+        kmeans_params = {
+            "random_seed": seed,
+            "min_dist": min_dist,
+            "max_iterations": max_iter,
+            # the tiles are clustered as histograms
+            "engine": "numpy" if engine == "naive" else engine,
+            "init": init,
+        }
+        tile_colors = tile_colors or 2 * self._palette_size
+
+        n_jobs = n_jobs or os.cpu_count()
+        executor = None
+        if n_jobs > 1:
+            # multiprocessing is slow to import and only needed here
+            from concurrent.futures import ProcessPoolExecutor
+
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+
+        try:
+            stats = self._mapTiles(
+                boxes,
+                executor,
+                2 * n_jobs,
+                tile_colors,
+                color_space=color_space,
+                **kmeans_params,
+            )
+            colors, inertia = reduce_tiles(
+                stats, self._palette_size, color_space=color_space, **kmeans_params
+            )
+            for _ in range(refine_iterations):
+                stats = self._mapTiles(
+                    boxes,
+                    executor,
+                    2 * n_jobs,
+                    len(colors),
+                    colors,
+                    color_space=color_space,
+                )
+                colors, inertia = reduce_tiles(
+                    stats, len(colors), color_space=color_space
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        report = {"tiles": len(boxes), "tile_size": tile_size, "inertia": inertia}
+        if compare:
+            logging.info("Extracting the colors from the whole image")
+            histogram = color_histogram(read_pixels(self._working_image))
+            reference = (
+                KMeans(
+                    n_clusters=self._palette_size,
+                    color_space=color_space,
+                    **kmeans_params,
+                )
+                .fit(*histogram)
+                .centroids
+            )
+            # both palettes are measured on all the pixels
+            report["inertia"] = palette_inertia(*histogram, colors, color_space)
+            report["reference_inertia"] = palette_inertia(
+                *histogram, reference, color_space
+            )
+            report["inertia_deviation"] = (
+                report["inertia"] / max(report["reference_inertia"], 1e-12) - 1
+            )
+            report["color_deviation"] = palette_deviation(
+                colors, reference, color_space
+            )
+            logging.info(
+                f"Inertia deviation from the whole image palette: "
+                f"{report['inertia_deviation']:+.2%}, largest color distance: "
+                f"{report['color_deviation']:.2f}"
+            )
+
+        self._colors = colors
+        self._tile_report = report
+        self._sortColors()
+        if self._low_memory:
+            self._releaseImage()
+
+        return report
+
+    def _mapTiles(
+        self,
+        boxes: list[tuple[int, ...]],
+        executor: Executor,
+        max_pending: int,
+        n_clusters: int,
+        centroids: list[Color] = None,
+        **params,
+    ) -> list[dict]:
+        """Get the statistics of the tiles of the working image.
+
+        Args:
+            boxes (list[tuple[int, ...]])
+            executor (Executor): Processes getting the statistics, \
+                in this process if None.
+            max_pending (int): Number of tiles waiting for a process at once, \
+                so that the pixels of all the tiles are not copied in memory.
+            n_clusters (int): Number of clusters of each tile.
+            centroids (list[Color], optional): Colors the pixels are assigned to. \
+                Defaults to None.
+
+        Returns:
+            list[dict]
+        """
+        stats = []
+        pending = []
+        for box in boxes:
+            pixels = read_pixels(self._working_image.crop(box))
+            if executor is None:
+                stats.append(tile_statistics(pixels, n_clusters, centroids, **params))
+                continue
+
+            pending.append(
+                executor.submit(
+                    tile_statistics, pixels, n_clusters, centroids, **params
+                )
+            )
+            if len(pending) > max_pending:
+                stats.append(pending.pop(0).result())
+
+        stats.extend(future.result() for future in pending)
+        for box, tile in zip(boxes, stats):
+            tile["box"] = list(box)
+        return stats
+
+    def _sortColors(self, colors: list[Color] = None):
+        """Sort the extracted colors by saturation and hue.
+
+        Args:
+            colors (list[Color], optional): Colors to sort in place. \
+                Defaults to the extracted colors.
+        """
+        if colors is None:
+            colors = self._colors
+        colors.sort(key=lambda x: x.saturation, reverse=False)
+        colors.sort(key=lambda x: x.hue, reverse=False)
+        logging.info("Colors extracted")
+
+    @timed("extract")
+    def extractFrameColors(
+        self,
+        seed: int = None,
+        min_dist: int = 25,
+        max_iter: int = 5,
+        engine: str = "numpy",
+        histogram: bool = False,
+        init: str = "random",
+        color_space: str = "rgb",
+        warm_start: bool = True,
+    ):
+        """Extract the colors of every frame of an animated or multi-page image.
+
+        The frames are clustered with the KMeans algorithm, each one starting \
+            from the colors of the previous one so that similar consecutive \
+            frames converge in a few iterations. The palette of all the frames \
+            together becomes the palette of the image. \
+            See extractColors for the description of the other arguments.
+
+        Args:
+            warm_start (bool, optional): Start each frame from the colors \
+                of the previous one. Defaults to True.
+        """
+        if self._im is None:
+            raise ValueError("The image has been released, load it again")
+
+        n_frames = getattr(self._im, "n_frames", 1)
+        logging.info(f"Starting color extraction of {n_frames} frames")
+
+        self._frame_colors = []
+        self._auto_scores = None
+        self._tile_report = None
+        self._truncated = False
+        self._frame_durations = []
+        previous = None
+        # histogram of the pixels of all the frames
+        colors = np.empty((0, 3), dtype=np.uint8)
+        counts = np.empty(0, dtype=np.int64)
+
+        for index in range(n_frames):
+            self._im.seek(index)
+            frame = self._frameImage()
+
+            quantizer = KMeansQuantizer(
+                n_colors=self._palette_size,
+                seed=seed,
+                min_dist=min_dist,
+                max_iter=max_iter,
+                engine=engine,
+                histogram=histogram,
+                init=init,
+                color_space=color_space,
+                initial_centroids=previous if warm_start else None,
+                metrics=self._metrics,
+            )
+            frame_colors = quantizer.quantize(frame)
+            previous = frame_colors.copy()
+            self._sortColors(frame_colors)
+            self._frame_colors.append(frame_colors)
+            self._frame_durations.append(self._im.info.get("duration"))
+
+            frame_histogram = color_histogram(read_pixels(frame))
+            colors, counts = color_histogram(
+                np.concatenate([colors, frame_histogram[0]]),
+                np.concatenate([counts, frame_histogram[1]]),
+            )
+            logging.info(f"Frame {index} completed")
+
+        self._im.seek(0)
+
+        logging.info("Extracting the palette of all the frames")
         self._colors = (
             KMeans(
                 n_clusters=self._palette_size,
                 random_seed=seed,
                 min_dist=min_dist,
                 max_iterations=max_iter,
+                # the histogram of all the frames needs an array engine
+                engine="numpy" if engine == "naive" else engine,
+                init=init,
+                color_space=color_space,
+                metrics=self._metrics,
             )
-            .fit(pixels=pixels_list)
+            .fit(colors, weights=counts)
             .centroids
         )
-        # sort by saturation and hue
-        self._colors.sort(key=lambda x: x.saturation, reverse=False)
-        self._colors.sort(key=lambda x: x.hue, reverse=False)
-        logging.info("Colors extracted")
+        self._sortColors()
+        if self._low_memory:
+            self._releaseImage()
+
+    def _frameImage(self) -> Image.Image:
+        """Get the current frame of the image, resized like the working image.
+
+        Returns:
+            Image.Image
+        """
+        frame = self._im.convert("RGB")
+        if not self._load_params["resize"]:
+            return frame
 
+        size = self._resizedSize(
+            frame.size,
+            self._load_params["resize_width"] or self._resized_width,
+            self._load_params["resize_megapixels"],
+        )
+        if size is None:
+            return frame
+
+        return frame.resize(
+            size,
+            resample=Image.Resampling[self._load_params["resample"].upper()],
+            reducing_gap=self._reducing_gap,
+        )
+
+    @timed("generate")
     def generatePalette(self, output_width: int = 1000, output_height: int = 200):
         """Generate a palette image.
 
@@ -91,6 +863,9 @@ class PaletteExtractor:
             output_width (int, optional): Defaults to 1000.
             output_height (int, optional): Defaults to 200.
         """
+        # ImageDraw is only imported when an image is drawn
+        from PIL import ImageDraw
+
         # generates an image containing the palette
         logging.info("Starting palette image generation")
         bars_width = int(output_width / self._palette_size)
@@ -109,6 +884,7 @@ class PaletteExtractor:
             i += 1
         logging.info("Palette image generated")
 
+    @timed("incorporate")
     def incorporatePalette(
         self,
         output_scl: float = 0.9,
@@ -136,6 +912,7 @@ class PaletteExtractor:
             position (Position, optional): Position of the palette. \
                  Defaults to Position.RIGHT.
         """
+        from PIL import ImageDraw
 
         if background_color is None:
             background_color = Color(220, 220, 220)
@@ -144,15 +921,24 @@ class PaletteExtractor:
 
         logging.info("Incorporating palette in the image")
 
+        image = self._im
+        if image is None:
+            # the released image is decoded again and freed once pasted,
+            # so the output is the only full size image left
+            image = Image.open(self._path)
+            if image.mode != "RGB":
+                # converted before the output is created instead of by paste
+                image = image.convert("RGB")
+
         # image resized
 
         if position == Position.RIGHT or position == Position.LEFT:
             # image size
-            new_width = int(self._im.width * output_scl)
-            new_height = int(self._im.height)
+            new_width = int(image.width * output_scl)
+            new_height = int(image.height)
             # bars container size
-            container_width = int(self._im.width * (1 - output_scl))
-            container_height = int(self._im.height)
+            container_width = int(image.width * (1 - output_scl))
+            container_height = int(image.height)
             # bars size
             bar_width = int(container_width * color_width_scl)
             bar_height = int(container_height / len(self._colors))
@@ -165,11 +951,11 @@ class PaletteExtractor:
             color_dy = int((bar_height - color_height) / 2)
         else:
             # image size
-            new_width = int(self._im.width)
-            new_height = int(self._im.height * output_scl)
+            new_width = int(image.width)
+            new_height = int(image.height * output_scl)
             # bars container size
-            container_width = int(self._im.width)
-            container_height = int(self._im.height * (1 - output_scl))
+            container_width = int(image.width)
+            container_height = int(image.height * (1 - output_scl))
             # bars size
             bar_width = int(container_width / len(self._colors))
             bar_height = int(container_height * color_height_scl)
@@ -205,12 +991,12 @@ class PaletteExtractor:
 
             self._incorporated_palette = Image.new("RGB", (new_width, new_height))
             if position == Position.RIGHT:
-                self._incorporated_palette.paste(self._im, (0, 0))
+                self._incorporated_palette.paste(image, (0, 0))
                 self._incorporated_palette.paste(
                     container, (new_width - container_width, 0)
                 )
             elif position == Position.LEFT:
-                self._incorporated_palette.paste(self._im, (container_width, 0))
+                self._incorporated_palette.paste(image, (container_width, 0))
                 self._incorporated_palette.paste(container, (0, 0))
         else:
             for i, c in enumerate(self._colors):
@@ -225,13 +1011,13 @@ class PaletteExtractor:
 
             self._incorporated_palette = Image.new("RGB", (new_width, new_height))
             if position == Position.BOTTOM:
-                self._incorporated_palette.paste(self._im, (0, 0))
+                self._incorporated_palette.paste(image, (0, 0))
                 self._incorporated_palette.paste(
                     container, (0, new_height - container_height)
                 )
 
             elif position == Position.TOP:
-                self._incorporated_palette.paste(self._im, (0, container_height))
+                self._incorporated_palette.paste(image, (0, container_height))
                 self._incorporated_palette.paste(container, (0, 0))
 
         logging.info("Palette incorporated")
@@ -242,52 +1028,148 @@ class PaletteExtractor:
         Args:
             path (str): Path to the JSON file.
         """
+        self._colors = self._readPaletteJSON(path)
+
+    def _readPaletteJSON(self, path: str) -> list[Color]:
+        """Read the colors of a palette JSON file.
+
+        The aggregate palette of a frames JSON file is read.
+
+        Args:
+            path (str): Path to the JSON file.
+
+        Returns:
+            list[Color]
+        """
         with open(path, "r") as f:
             data = json.load(f)
-        self._colors = [Color(*c) for c in data["rgb"]]
+        if "aggregate" in data:
+            data = data["aggregate"]
+        return [Color(*c) for c in data["rgb"]]
 
     def printPalette(self):
         """Print the palette in the console.
 
         The console must support TrueColor.
         """
-        # print the palette in the console
-        cells = []
-        BAR_WIDTH = 16
-        for c in self._colors:
-            row = []
-            row.append(Cell("█" * BAR_WIDTH, fore=c))
-            row.append(Cell(c.rgb_formatted))
-            row.append(Cell(c.hsv_formatted))
-            row.append(Cell(c.hex))
-            cells.append(row)
+        from .terminal import format_palette
 
-        print(format_table(cells, border_fore=Color(211, 211, 211)))
+        # print the palette in the console
+        print(format_palette(self._colors))
 
-    def savePaletteImage(self, folder: str = "output/"):
+    def savePaletteImage(
+        self,
+        folder: str = "output/",
+        format: str = "png",
+        quality: int = None,
+        compression: int = None,
+    ):
         """Save the palette image.
 
+        See _saveImage for the description of the arguments.
+
         Args:
             folder (str, optional). Defaults to "output/".
         """
-        self._createFolder(folder)
-        path = f"{folder}{self._filename}-palette.png"
-        self._palette.save(path)
-
-        logging.info(f"Palette image saved. Path: {path}")
+        self._saveImage(self._palette, folder, "palette", format, quality, compression)
 
-    def saveIncorporatedPalette(self, folder: str = "output/"):
+    def saveIncorporatedPalette(
+        self,
+        folder: str = "output/",
+        format: str = "png",
+        quality: int = None,
+        compression: int = None,
+    ):
         """Save the image with the palette incorporated.
 
+        See _saveImage for the description of the arguments.
+
         Args:
             folder (str, optional). Defaults to "output/".
         """
+        self._saveImage(
+            self._incorporated_palette,
+            folder,
+            "incorporated-palette",
+            format,
+            quality,
+            compression,
+        )
+
+    def _saveImage(
+        self,
+        image: Image.Image,
+        folder: str,
+        suffix: str,
+        format: str = "png",
+        quality: int = None,
+        compression: int = None,
+    ):
+        """Save an image, in the background if the extractor has an executor.
+
+        Args:
+            image (Image.Image)
+            folder (str)
+            suffix (str): Suffix of the file name, after the name of the image.
+            format (str, optional): "png", "jpeg" or "webp". Defaults to "png".
+            quality (int, optional): Quality of the JPEG and WebP images, \
+                in range 0-100. Ignored by PNG. Defaults to the Pillow default.
+            compression (int, optional): Compression level of the PNG images, \
+                in range 0-9, or compression method of the WebP images, \
+                in range 0-6. Higher values give smaller files and are slower \
+                to encode. Ignored by JPEG. Defaults to the Pillow default.
+        """
+        if format not in self._image_formats:
+            raise ValueError(f"Format must be one of {', '.join(self._image_formats)}")
+
+        params = {}
+        if quality is not None and format != "png":
+            if not 0 <= quality <= 100:
+                raise ValueError("Quality must be in range 0-100")
+            params["quality"] = quality
+
+        if compression is not None and format != "jpeg":
+            max_compression = 9 if format == "png" else 6
+            if not 0 <= compression <= max_compression:
+                raise ValueError(
+                    f"Compression of {format} must be in range 0-{max_compression}"
+                )
+            params["compress_level" if format == "png" else "method"] = compression
+
         self._createFolder(folder)
-        path = f"{folder}{self._filename}-incorporated-palette.png"
-        self._incorporated_palette.save(path)
+        path = f"{folder}{self._filename}-{suffix}.{self._image_formats[format]}"
+        self._outputs.append(path)
+        if self._executor is None:
+            self._encodeImage(image, path, format, params)
+        else:
+            self._saves.append(
+                self._executor.submit(self._encodeImage, image, path, format, params)
+            )
+
+    @timed("save")
+    def _encodeImage(self, image: Image.Image, path: str, format: str, params: dict):
+        """Encode an image and write it to a file.
+
+        Args:
+            image (Image.Image)
+            path (str)
+            format (str)
+            params (dict): Options of the Pillow encoder.
+        """
+        image.save(path, format=format, **params)
+        logging.info(f"Image saved. Path: {path}")
 
-        logging.info(f"Incorporated palette image saved. Path: {path}")
+    def waitSaved(self):
+        """Wait until the images encoded in the background are written.
 
+        Raises:
+            Exception: The first error raised while saving an image.
+        """
+        saves, self._saves = self._saves, []
+        for future in saves:
+            future.result()
+
+    @timed("save")
     def savePaletteJSON(self, folder: str = "output/"):
         """Save the palette in a JSON file.
 
@@ -295,18 +1177,116 @@ class PaletteExtractor:
             folder (str, optional). Defaults to "output/".
         """
         self._createFolder(folder)
+        json_dict = self._extractionDict()
+
+        path = f"{folder}{self._filename}-json-palette.json"
+        with open(path, "w") as json_file:
+            json.dump(json_dict, json_file, indent=2)
+        self._outputs.append(path)
+
+        logging.info(f"JSON file saved. Path: {path}")
+
+    @timed("save")
+    def saveFramesJSON(self, folder: str = "output/"):
+        """Save the palettes of all the frames in a single JSON file.
+
+        The file contains the palette of each frame, with its index and \
+            duration in milliseconds (null if the format has none), \
+            and the palette of all the frames together.
+
+        Args:
+            folder (str, optional). Defaults to "output/".
+        """
+        if self._frame_colors is None:
+            raise ValueError("The colors of the frames have not been extracted")
+
+        self._createFolder(folder)
+        json_dict = self.paletteDict()
+
+        path = f"{folder}{self._filename}-frames-palette.json"
+        with open(path, "w") as json_file:
+            json.dump(json_dict, json_file, indent=2)
+        self._outputs.append(path)
+
+        logging.info(f"JSON file saved. Path: {path}")
+
+    def paletteDict(self) -> dict:
+        """Get the palette in the format of the JSON files.
+
+        If the colors of the frames have been extracted, the format \
+            of the frames JSON file is used. If the palette size has been \
+            chosen automatically, the scores of each size are included, \
+            if the tiles have been clustered separately, the tile report.
+
+        Returns:
+            dict
+        """
+        if self._frame_colors is None:
+            return self._extractionDict()
+
+        return {
+            "frames": [
+                {"index": index, "duration": duration, **self._paletteDict(colors)}
+                for index, (colors, duration) in enumerate(
+                    zip(self._frame_colors, self._frame_durations)
+                )
+            ],
+            "aggregate": self._paletteDict(self._colors),
+        }
+
+    def _extractionDict(self) -> dict:
+        """Get the palette and the report of its extraction.
+
+        Returns:
+            dict
+        """
+        json_dict = self._paletteDict(self._colors)
+        if self._truncated:
+            json_dict["truncated"] = True
+        if self._auto_scores is not None:
+            json_dict["scores"] = self._auto_scores
+        if self._tile_report is not None:
+            json_dict["tiles"] = self._tile_report
+        return json_dict
+
+    def _paletteDict(self, colors: list[Color]) -> dict:
+        """Get the components of a palette, in the format of the JSON files.
+
+        Args:
+            colors (list[Color])
+
+        Returns:
+            dict
+        """
         json_dict = {"rgb": [], "hsv": [], "hex": []}
 
-        for c in self._colors:
+        for c in colors:
             json_dict["rgb"].append(c.rgb)
             json_dict["hsv"].append(c.hsv)
             json_dict["hex"].append(c.hex)
 
-        path = f"{folder}{self._filename}-json-palette.json"
-        with open(path, "w") as json_file:
-            json.dump(json_dict, json_file, indent=2)
+        return json_dict
 
-        logging.info(f"JSON file saved. Path: {path}")
+    @property
+    def outputs(self) -> list[str]:
+        """Get the paths of the files saved so far.
+
+        The images saved in the background are listed as soon as they \
+            are submitted, call waitSaved to wait until they are written.
+
+        Returns:
+            list[str]
+        """
+        return self._outputs.copy()
+
+    @property
+    def truncated(self) -> bool:
+        """Check if the last KMeans fit was stopped before converging.
+
+        Returns:
+            bool
+        """
+        return self._truncated
 
     @property
     def _filename(self) -> str:
@@ -0,0 +1,126 @@
+"""Palette size selection module.
+
+The scores compare the palettes of different sizes extracted from the same \
+    pixels, in the color space they are clustered in.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+CRITERIA: tuple[str, ...] = ("silhouette", "elbow")
+
+
+def sample_points(
+    points: np.ndarray, weights: np.ndarray, size: int, seed: int = None
+) -> np.ndarray:
+    """Draw random points with probability proportional to their weight.
+
+    Sampling an histogram by the counts of its colors is equivalent \
+        to sampling the pixels of the image.
+
+    Args:
+        points (np.ndarray): Nx3 array.
+        weights (np.ndarray): Weight of each point.
+        size (int): Number of sampled points, drawn with replacement.
+        seed (int, optional): Seed of the sampling. Defaults to None.
+
+    Returns:
+        np.ndarray: size x 3 array.
+    """
+    rng = np.random.default_rng(seed)
+    cumulative = np.cumsum(weights, dtype=np.float64)
+    indices = np.searchsorted(cumulative, rng.random(size) * cumulative[-1], "right")
+    return points[indices.clip(max=len(points) - 1)]
+
+
+def pairwise_distances(points: np.ndarray) -> np.ndarray:
+    """Get the distances between every pair of points.
+
+    Args:
+        points (np.ndarray): Nx3 array.
+
+    Returns:
+        np.ndarray: NxN array of float64.
+    """
+    points = points.astype(np.float64)
+    sq_norms = (points**2).sum(axis=1)
+    sq_dist = sq_norms[:, None] + sq_norms[None, :] - 2 * points @ points.T
+    return np.sqrt(np.maximum(sq_dist, 0))
+
+
+def nearest_labels(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Get the index of the closest centroid of each point.
+
+    Args:
+        points (np.ndarray): Nx3 array.
+        centroids (np.ndarray): Kx3 array.
+
+    Returns:
+        np.ndarray
+    """
+    points = points.astype(np.float64)
+    centroids = centroids.astype(np.float64)
+    sq_dist = (centroids**2).sum(axis=1)[None, :] - 2 * points @ centroids.T
+    return sq_dist.argmin(axis=1)
+
+
+def silhouette(distances: np.ndarray, labels: np.ndarray) -> float:
+    """Get the mean silhouette of a clustering.
+
+    The silhouette of a point compares the mean distance to the points \
+        of its cluster (a) and to the points of the closest other cluster (b) \
+        as (b - a) / max(a, b). It ranges from -1 to 1, higher values mean \
+        compact and well separated clusters. Points alone in their cluster \
+        have a silhouette of 0.
+
+    Args:
+        distances (np.ndarray): NxN distances between the points.
+        labels (np.ndarray): Cluster of each point.
+
+    Returns:
+        float
+    """
+    labels = np.unique(labels, return_inverse=True)[1].ravel()
+    n_clusters = labels.max() + 1
+    if n_clusters < 2:
+        return 0.0
+
+    # sum of the distances between each point and the points of each cluster
+    one_hot = np.zeros((len(labels), n_clusters))
+    one_hot[np.arange(len(labels)), labels] = 1
+    sums = distances @ one_hot
+    sizes = one_hot.sum(axis=0)
+
+    own = np.arange(len(labels)), labels
+    a = sums[own] / np.maximum(sizes[labels] - 1, 1)
+    means = sums / sizes
+    means[own] = np.inf
+    b = means.min(axis=1)
+
+    scores = np.where(
+        sizes[labels] > 1, (b - a) / np.maximum(np.maximum(a, b), 1e-12), 0
+    )
+    return float(scores.mean())
+
+
+def elbow(sizes: list[int], inertias: list[float]) -> int:
+    """Get the palette size at the elbow of the inertia curve.
+
+    The elbow is the point of the curve farthest below the line joining \
+        its ends, after scaling both axes to the range 0-1.
+
+    Args:
+        sizes (list[int]): Increasing palette sizes.
+        inertias (list[float]): Inertia of each palette size.
+
+    Returns:
+        int: One of the sizes.
+    """
+    sizes = np.asarray(sizes, dtype=np.float64)
+    inertias = np.asarray(inertias, dtype=np.float64)
+    if len(sizes) < 3 or inertias[0] == inertias[-1]:
+        return int(sizes[0])
+
+    x = (sizes - sizes[0]) / (sizes[-1] - sizes[0])
+    y = (inertias - inertias[-1]) / (inertias[0] - inertias[-1])
+    return int(sizes[np.argmax((1 - x) - y)])
@@ -0,0 +1,225 @@
+"""Pixel ingestion module."""
+from __future__ import annotations
+
+import logging
+from typing import Iterator
+
+import numpy as np
+from PIL import Image
+
+
+def read_pixels(image: Image.Image) -> np.ndarray:
+    """Read the pixels of an image as a Nx3 array of uint8.
+
+    The array is built from the decoded buffer, column by column like \
+        the naive KMeans ingestion, so the same seed picks the same pixels.
+
+    Args:
+        image (Image.Image)
+
+    Returns:
+        np.ndarray
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    logging.info("Reading pixels from the image buffer")
+    buffer = np.frombuffer(image.tobytes(), dtype=np.uint8)
+    return np.ascontiguousarray(
+        buffer.reshape(image.height, image.width, 3).transpose(1, 0, 2)
+    ).reshape(-1, 3)
+
+
+# maximum number of pixels of the batches read in a single pass
+_batch_group_pixels: int = 2**20
+
+
+def iter_batches(
+    image: Image.Image,
+    batch_size: int,
+    max_batches: int,
+    seed: int = None,
+    band_height: int = 64,
+) -> Iterator[np.ndarray]:
+    """Yield batches of random pixels of an image.
+
+    The pixels of several batches, up to about a million, are drawn at once \
+        and read one band of rows at a time, so that only the bands and the \
+        sampled pixels are copied (converted to RGB if needed) instead of \
+        all the pixels. The decoded image itself is still held in memory.
+
+    Args:
+        image (Image.Image)
+        batch_size (int): Number of pixels in each batch.
+        max_batches (int): Number of batches to yield.
+        seed (int, optional): Seed of the sampling. Defaults to None.
+        band_height (int, optional): Number of rows read at once. Defaults to 64.
+
+    Yields:
+        np.ndarray: batch_size x 3 array of uint8.
+    """
+    rng = np.random.default_rng(seed)
+    group_size = max(1, _batch_group_pixels // batch_size)
+    for first in range(0, max_batches, group_size):
+        xs, ys = [], []
+        for _ in range(min(group_size, max_batches - first)):
+            xs.append(rng.integers(image.width, size=batch_size))
+            ys.append(rng.integers(image.height, size=batch_size))
+        xs, ys = np.concatenate(xs), np.concatenate(ys)
+
+        sample = np.empty((len(xs), 3), dtype=np.uint8)
+        order = np.argsort(ys, kind="stable")
+        bands = ys[order] // band_height
+        band_ids = np.unique(bands)
+        starts = np.searchsorted(bands, band_ids)
+        ends = np.searchsorted(bands, band_ids, side="right")
+        for band, start, end in zip(band_ids.tolist(), starts, ends):
+            upper = band * band_height
+            lower = min(upper + band_height, image.height)
+            rows = image.crop((0, upper, image.width, lower))
+            if rows.mode != "RGB":
+                rows = rows.convert("RGB")
+            rows = np.frombuffer(rows.tobytes(), dtype=np.uint8).reshape(
+                lower - upper, image.width, 3
+            )
+            index = order[start:end]
+            sample[index] = rows[ys[index] - upper, xs[index]]
+
+        yield from sample.reshape(-1, batch_size, 3)
+
+
+def color_histogram(
+    pixels: np.ndarray, weights: np.ndarray = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Collapse the pixels into their unique colors and their counts.
+
+    Args:
+        pixels (np.ndarray): Nx3 array of uint8.
+        weights (np.ndarray, optional): Number of occurrences of each pixel, \
+            used to merge histograms. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Mx3 array of unique colors \
+            and the number of pixels of each color.
+    """
+    # pack each color into a single integer to find the unique ones quickly
+    keys = (
+        pixels[:, 0].astype(np.uint32) << 16
+        | pixels[:, 1].astype(np.uint32) << 8
+        | pixels[:, 2]
+    )
+    if weights is None:
+        unique, counts = np.unique(keys, return_counts=True)
+    else:
+        unique, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=weights).astype(np.int64)
+    colors = np.stack(
+        [(unique >> 16) & 0xFF, (unique >> 8) & 0xFF, unique & 0xFF], axis=1
+    ).astype(np.uint8)
+
+    logging.info(f"Found {len(colors)} unique colors in {counts.sum()} pixels")
+    return colors, counts
+
+
+SAMPLING_METHODS: tuple[str, ...] = ("uniform", "stratified", "reservoir")
+
+
+def sample_pixels(
+    image: Image.Image,
+    size: int,
+    method: str = "uniform",
+    seed: int = None,
+    band_height: int = 64,
+) -> np.ndarray:
+    """Read a random sample of the pixels of an image, without replacement.
+
+    "uniform" draws any pixel with the same probability. "stratified" splits \
+        the image into a grid of about as many cells as sampled pixels and \
+        draws one pixel from each of them, so that every region of the image \
+        is represented in proportion to its area. "reservoir" visits every \
+        pixel of the image once, one band of rows at a time, and is slower \
+        than "uniform": the whole image is still decoded.
+
+    Args:
+        image (Image.Image)
+        size (int): Number of sampled pixels. If the image has fewer pixels, \
+            all of them are read.
+        method (str, optional): "uniform", "stratified" or "reservoir". \
+            Defaults to "uniform".
+        seed (int, optional): Seed of the sampling. Defaults to None.
+        band_height (int, optional): Number of rows read at once \
+            by the reservoir sampling. Defaults to 64.
+
+    Returns:
+        np.ndarray: Nx3 array of uint8.
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Sampling must be one of {', '.join(SAMPLING_METHODS)}")
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    width, height = image.size
+    total = width * height
+    if size >= total:
+        return read_pixels(image)
+
+    logging.info(f"Sampling {size} of {total} pixels ({method})")
+    rng = np.random.default_rng(seed)
+    if method == "reservoir":
+        return _reservoir_sample(image, size, rng, band_height)
+
+    if method == "uniform":
+        indices = rng.choice(total, size=size, replace=False)
+        xs, ys = indices % width, indices // width
+    else:
+        # about square cells stretched to cover the image, their sides differ
+        # by at most a pixel and they don't overlap, one pixel drawn from each
+        side = (total / size) ** 0.5
+        columns, rows = int(np.ceil(width / side)), int(np.ceil(height / side))
+        x_edges = np.linspace(0, width, columns + 1).astype(np.int64)
+        y_edges = np.linspace(0, height, rows + 1).astype(np.int64)
+        cells = rng.choice(columns * rows, size=size, replace=False)
+        column, row = cells % columns, cells // columns
+        xs = x_edges[column] + (
+            rng.random(size) * (x_edges[column + 1] - x_edges[column])
+        ).astype(np.int64)
+        ys = y_edges[row] + (
+            rng.random(size) * (y_edges[row + 1] - y_edges[row])
+        ).astype(np.int64)
+
+    pixels = image.load()
+    return np.array(
+        [pixels[x, y] for x, y in zip(xs.tolist(), ys.tolist())], dtype=np.uint8
+    )
+
+
+def _reservoir_sample(
+    image: Image.Image, size: int, rng: np.random.Generator, band_height: int
+) -> np.ndarray:
+    # Algorithm R on bands of rows: the i-th pixel replaces a random pixel
+    # of the sample with probability size / (i + 1). Within a band, the
+    # later pixels overwrite the earlier ones drawing the same position,
+    # as they would one at a time
+    sample = np.empty((size, 3), dtype=np.uint8)
+    seen = 0
+    for upper in range(0, image.height, band_height):
+        band = image.crop(
+            (0, upper, image.width, min(upper + band_height, image.height))
+        )
+        pixels = np.frombuffer(band.tobytes(), dtype=np.uint8).reshape(-1, 3)
+        if seen < size:
+            # the first pixels fill the sample, over as many bands as needed
+            filled = min(size - seen, len(pixels))
+            sample[seen : seen + filled] = pixels[:filled]
+            pixels = pixels[filled:]
+            seen += filled
+        if not len(pixels):
+            continue
+
+        positions = rng.integers(0, np.arange(seen + 1, seen + len(pixels) + 1))
+        kept = positions < size
+        sample[positions[kept]] = pixels[kept]
+        seen += len(pixels)
+
+    return sample
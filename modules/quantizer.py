@@ -0,0 +1,478 @@
+"""Color quantizers module."""
+from __future__ import annotations
+
+import logging
+from abc import ABC, abstractmethod
+
+import numpy as np
+from PIL import Image
+
+from .color import Color
+from .colorspace import rgb_to_lab
+from .kmeans import KMeans
+from .metrics import Metrics
+from .palette_size import nearest_labels
+from .pixels import color_histogram, iter_batches, read_pixels, sample_pixels
+from .tiles import map_tiles, reduce_tiles, tile_boxes
+
+
+class Quantizer(ABC):
+    """Base class of the algorithms reducing an image to a few colors."""
+
+    # set if the last colors were extracted by a fit stopped early
+    truncated: bool = False
+
+    def __init__(self, n_colors: int, metrics: Metrics = None) -> Quantizer:
+        """Initialize a Quantizer object.
+
+        Args:
+            n_colors (int): number of colors to extract
+            metrics (Metrics, optional): record of the extraction. Defaults to None.
+
+        Returns:
+            Quantizer
+        """
+        self._n_colors = n_colors
+        self._metrics = metrics
+
+    @abstractmethod
+    def quantize(self, image: Image.Image) -> list[Color]:
+        """Extract the dominant colors of an image.
+
+        Args:
+            image (Image.Image)
+
+        Returns:
+            list[Color]: unsorted colors
+        """
+
+
+class KMeansQuantizer(Quantizer):
+    """Quantizer clustering the pixels with the KMeans algorithm."""
+
+    # number of pixels of the first sample when the sample size is chosen
+    # to reach a target error
+    _pilot_size: int = 20000
+    # side of the tiles read by the refinement pass
+    _refine_tile_size: int = 1024
+
+    def __init__(
+        self,
+        n_colors: int,
+        seed: int = None,
+        min_dist: int = 25,
+        max_iter: int = 5,
+        engine: str = "numpy",
+        histogram: bool = False,
+        init: str = "random",
+        n_init: int = 1,
+        n_jobs: int = 1,
+        batch_size: int = None,
+        max_batches: int = 1000,
+        color_space: str = "rgb",
+        initial_centroids: list[Color] = None,
+        metrics: Metrics = None,
+        max_total_iter: int = None,
+        tol: float = 0,
+        max_time: float = None,
+        sample: str = None,
+        sample_size: int = None,
+        sample_error: float = None,
+        refine: bool = False,
+    ) -> KMeansQuantizer:
+        """Initialize a KMeansQuantizer object.
+
+        See PaletteExtractor.extractColors for the description of the arguments.
+
+        Returns:
+            KMeansQuantizer
+        """
+        super().__init__(n_colors, metrics)
+
+        if histogram and engine == "naive":
+            raise ValueError("The histogram mode is not supported by the naive engine")
+
+        if batch_size is not None and (engine == "naive" or histogram):
+            raise ValueError(
+                "The mini-batch mode is not supported by the naive engine "
+                "nor the histogram mode"
+            )
+
+        if sample is None and (
+            sample_size is not None or sample_error is not None or refine
+        ):
+            raise ValueError("Choose the sampling method")
+
+        if sample is not None and batch_size is not None:
+            raise ValueError("The mini-batch mode already samples the pixels")
+
+        if sample_size is not None and sample_size < 1:
+            raise ValueError("The sample size must be at least 1")
+
+        if sample_error is not None and sample_error <= 0:
+            raise ValueError("The sample error must be positive")
+
+        self._seed = seed
+        self._engine = engine
+        self._histogram = histogram
+        self._batch_size = batch_size
+        self._max_batches = max_batches
+        self._kmeans_params = {
+            "n_clusters": n_colors,
+            "random_seed": seed,
+            "min_dist": min_dist,
+            "max_iterations": max_iter,
+            "engine": engine,
+            "init": init,
+            "color_space": color_space,
+            "initial_centroids": initial_centroids,
+            "metrics": metrics,
+            "max_total_iterations": max_total_iter,
+            "tol": tol,
+            "max_time": max_time,
+        }
+        self._n_init = n_init
+        self._n_jobs = n_jobs
+        self._color_space = color_space
+        self._sample = sample
+        self._sample_size = sample_size
+        self._sample_error = sample_error
+        self._refine = refine
+
+    def quantize(self, image: Image.Image) -> list[Color]:
+        """Extract the dominant colors of an image.
+
+        Args:
+            image (Image.Image)
+
+        Returns:
+            list[Color]: unsorted colors
+        """
+        if self._batch_size is not None:
+            kmeans = KMeans(**self._kmeans_params)
+            for batch in iter_batches(
+                image, self._batch_size, self._max_batches, self._seed
+            ):
+                if kmeans.partial_fit(batch).converged:
+                    break
+
+            return kmeans.centroids
+
+        if self._sample is not None:
+            return self._quantizeSample(image)
+
+        weights = None
+        if self._engine == "naive":
+            pixels = image.load()
+            # need to convert to list the list of lists
+            pixels_list = [
+                Color(*pixels[x, y])
+                for x in range(image.width)
+                for y in range(image.height)
+            ]
+        else:
+            # the array engines read the image buffer directly,
+            # no Color is created until the centroids are found
+            pixels_list = read_pixels(image)
+            if self._histogram:
+                pixels_list, weights = color_histogram(pixels_list)
+        # run the KMeans algorithm
+        kmeans = KMeans(
+            **self._kmeans_params, n_init=self._n_init, n_jobs=self._n_jobs
+        ).fit(pixels=pixels_list, weights=weights)
+        self.truncated = kmeans.truncated
+        return kmeans.centroids
+
+    def _quantizeSample(self, image: Image.Image) -> list[Color]:
+        """Extract the dominant colors of a random sample of the pixels.
+
+        If a target error is set, a first sample is clustered to estimate \
+            the spread and the share of each cluster, and a second sample \
+            large enough for the standard error of every centroid to be \
+            below the target is clustered starting from its colors. \
+            The refinement assigns all the pixels to the colors and moves \
+            them to the mean of their pixels.
+
+        Args:
+            image (Image.Image)
+
+        Returns:
+            list[Color]: unsorted colors
+        """
+        total = image.width * image.height
+        size = self._sample_size
+        if size is None:
+            size = self._pilot_size if self._sample_error is not None else 100_000
+
+        pixels = sample_pixels(image, size, self._sample, self._seed)
+        kmeans = self._fitSample(pixels, self._kmeans_params)
+
+        if self._sample_error is not None:
+            errors = self._centroidErrors(pixels, kmeans.centroids)
+            # the standard error of a centroid decreases with the square root
+            # of the number of pixels, the share of each cluster being the same
+            needed = int(
+                np.ceil(errors.max() ** 2 * len(pixels) / self._sample_error**2)
+            )
+            logging.info(
+                f"Largest centroid standard error {errors.max():.3f} on "
+                f"{len(pixels)} pixels, {needed} needed for {self._sample_error}"
+            )
+            if needed > len(pixels) and len(pixels) < total:
+                # a fresh sample, so that its pixels are drawn only once
+                pixels = sample_pixels(
+                    image,
+                    min(needed, total),
+                    self._sample,
+                    None if self._seed is None else self._seed + 1,
+                )
+                kmeans = self._fitSample(
+                    pixels,
+                    {**self._kmeans_params, "initial_centroids": kmeans.centroids},
+                )
+                errors = self._centroidErrors(pixels, kmeans.centroids)
+                logging.info(
+                    f"Largest centroid standard error {errors.max():.3f} "
+                    f"on {len(pixels)} pixels"
+                )
+
+        if self._metrics is not None:
+            self._metrics.add("sampled_pixels", len(pixels))
+
+        self.truncated = kmeans.truncated
+        colors = kmeans.centroids
+        if self._refine:
+            logging.info("Refining the colors on all the pixels")
+            stats = map_tiles(
+                image,
+                tile_boxes(image.size, self._refine_tile_size),
+                len(colors),
+                centroids=colors,
+                color_space=self._color_space,
+            )
+            colors, _ = reduce_tiles(stats, len(colors), self._color_space)
+        return colors
+
+    def _fitSample(self, pixels: np.ndarray, params: dict) -> KMeans:
+        # fit the KMeans model on sampled pixels, like on the whole image
+        weights = None
+        if self._engine == "naive":
+            pixels = [Color(*p) for p in pixels.tolist()]
+        elif self._histogram:
+            pixels, weights = color_histogram(pixels)
+        return KMeans(**params, n_init=self._n_init, n_jobs=self._n_jobs).fit(
+            pixels=pixels, weights=weights
+        )
+
+    def _centroidErrors(self, pixels: np.ndarray, centroids: list[Color]) -> np.ndarray:
+        # standard error of the position of each centroid, estimated from
+        # the spread of its pixels in the sample
+        def toSpace(rgb: np.ndarray) -> np.ndarray:
+            if self._color_space == "lab":
+                return rgb_to_lab(rgb)
+            return rgb.astype(np.float64)
+
+        points = toSpace(pixels)
+        centers = toSpace(np.array([c.rgb for c in centroids], dtype=np.uint8))
+        labels = nearest_labels(points, centers)
+        counts = np.bincount(labels, minlength=len(centers))
+        sq_dist = ((points - centers[labels]) ** 2).sum(axis=1)
+        variances = np.bincount(labels, weights=sq_dist, minlength=len(centers))
+        variances /= np.maximum(counts - 1, 1)
+        return np.sqrt(variances / np.maximum(counts, 1))
+
+
+class MedianCutQuantizer(Quantizer):
+    """Quantizer recursively splitting the color space at the median color."""
+
+    def quantize(self, image: Image.Image) -> list[Color]:
+        """Extract the dominant colors of an image.
+
+        The box containing the most pixels times its widest channel range \
+            is split in two halves with the same number of pixels, \
+            until there are as many boxes as colors.
+
+        Args:
+            image (Image.Image)
+
+        Returns:
+            list[Color]: unsorted colors
+        """
+        colors, counts = color_histogram(read_pixels(image))
+        boxes = [np.arange(len(colors))]
+        scores = [self._score(colors, counts, boxes[0])]
+
+        while len(boxes) < self._n_colors:
+            best_box = int(np.argmax([score for score, _ in scores]))
+            score, channel = scores[best_box]
+            if score == 0:
+                # every box contains a single color
+                break
+
+            box = boxes.pop(best_box)
+            scores.pop(best_box)
+            box = box[np.argsort(colors[box, channel], kind="stable")]
+            cumulative = np.cumsum(counts[box])
+            # cut at the median pixel, keeping both halves non empty
+            cut = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+            cut = min(max(cut, 1), len(box) - 1)
+            for half in (box[:cut], box[cut:]):
+                boxes.append(half)
+                scores.append(self._score(colors, counts, half))
+
+        logging.info(f"Split the colors into {len(boxes)} boxes")
+        labels = np.empty(len(colors), dtype=np.intp)
+        for i, box in enumerate(boxes):
+            labels[box] = i
+        return _weighted_means(colors, counts, labels)
+
+    def _score(
+        self, colors: np.ndarray, counts: np.ndarray, box: np.ndarray
+    ) -> tuple[int, int]:
+        # number of pixels times the widest channel range, and that channel
+        box_colors = colors[box]
+        ranges = box_colors.max(axis=0).astype(int) - box_colors.min(axis=0)
+        return int(ranges.max()) * int(counts[box].sum()), int(ranges.argmax())
+
+
+class OctreeQuantizer(Quantizer):
+    """Quantizer merging the least populated leaves of an octree of colors."""
+
+    def quantize(self, image: Image.Image) -> list[Color]:
+        """Extract the dominant colors of an image.
+
+        The colors are inserted in an octree, each level using one more bit \
+            of every channel. Starting from the shallowest level with more \
+            leaves than colors, the leaves of the least populated nodes \
+            are merged until there are as many leaves as colors.
+
+        Args:
+            image (Image.Image)
+
+        Returns:
+            list[Color]: unsorted colors
+        """
+        colors, counts = color_histogram(read_pixels(image))
+
+        for depth in range(1, 9):
+            leaves, inverse = np.unique(
+                self._nodeKeys(colors, depth), return_inverse=True
+            )
+            if len(leaves) > self._n_colors:
+                break
+
+        inverse = inverse.ravel()
+        leaf_counts = np.bincount(inverse, weights=counts)
+        leaf_parents = self._parentKeys(leaves, depth)
+        parents = np.unique(leaf_parents)
+        parent_counts = np.bincount(
+            np.searchsorted(parents, leaf_parents), weights=leaf_counts
+        )
+
+        # merge the leaves of the least populated nodes first
+        leaf_labels = np.arange(len(leaves))
+        n_leaves = len(leaves)
+        for parent in parents[np.argsort(parent_counts, kind="stable")]:
+            if n_leaves <= self._n_colors:
+                break
+
+            children = np.flatnonzero(leaf_parents == parent)
+            children = children[np.argsort(leaf_counts[children], kind="stable")]
+            # merge only as many children as needed to reach the number of colors
+            n_merged = min(len(children), n_leaves - self._n_colors + 1)
+            leaf_labels[children[:n_merged]] = children[0]
+            n_leaves -= n_merged - 1
+
+        logging.info(f"Reduced the octree to {n_leaves} leaves at depth {depth}")
+        return _weighted_means(colors, counts, leaf_labels[inverse])
+
+    def _nodeKeys(self, colors: np.ndarray, depth: int) -> np.ndarray:
+        # index of the node containing each color at a given depth,
+        # built from the top depth bits of each channel
+        top = colors.astype(np.uint32) >> (8 - depth)
+        return top[:, 0] << (2 * depth) | top[:, 1] << depth | top[:, 2]
+
+    def _parentKeys(self, keys: np.ndarray, depth: int) -> np.ndarray:
+        # index of the parent of each node, dropping the lowest bit of each channel
+        mask = (1 << depth) - 1
+        r = (keys >> (2 * depth) & mask) >> 1
+        g = (keys >> depth & mask) >> 1
+        b = (keys & mask) >> 1
+        return r << (2 * (depth - 1)) | g << (depth - 1) | b
+
+
+class PillowQuantizer(Quantizer):
+    """Quantizer using the C implementation of Image.quantize in Pillow."""
+
+    methods: dict[str, Image.Quantize] = {
+        "median-cut": Image.Quantize.MEDIANCUT,
+        "max-coverage": Image.Quantize.MAXCOVERAGE,
+        "fast-octree": Image.Quantize.FASTOCTREE,
+    }
+
+    def __init__(
+        self, n_colors: int, method: str = "median-cut", metrics: Metrics = None
+    ) -> PillowQuantizer:
+        """Initialize a PillowQuantizer object.
+
+        Args:
+            n_colors (int): number of colors to extract, at most 256
+            method (str, optional): quantization method of Pillow, \
+                "median-cut", "max-coverage" or "fast-octree". \
+                Defaults to "median-cut".
+            metrics (Metrics, optional): record of the extraction. Defaults to None.
+
+        Returns:
+            PillowQuantizer
+        """
+        super().__init__(n_colors, metrics)
+
+        if n_colors > 256:
+            raise ValueError("Pillow can extract at most 256 colors")
+
+        if method not in self.methods:
+            raise ValueError(f"Method must be one of {', '.join(self.methods)}")
+
+        self._method = self.methods[method]
+
+    def quantize(self, image: Image.Image) -> list[Color]:
+        """Extract the dominant colors of an image.
+
+        Args:
+            image (Image.Image)
+
+        Returns:
+            list[Color]: unsorted colors
+        """
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        quantized = image.quantize(colors=self._n_colors, method=self._method)
+        palette = quantized.getpalette()
+        # only keep the palette entries that are actually used
+        used = sorted(quantized.getcolors(maxcolors=256), reverse=True)
+        return [Color(*palette[3 * i : 3 * i + 3]) for _, i in used]
+
+
+QUANTIZERS: dict[str, type[Quantizer]] = {
+    "kmeans": KMeansQuantizer,
+    "median-cut": MedianCutQuantizer,
+    "octree": OctreeQuantizer,
+    "pillow": PillowQuantizer,
+}
+
+
+def _weighted_means(
+    colors: np.ndarray, counts: np.ndarray, labels: np.ndarray
+) -> list[Color]:
+    # weighted mean color of each group of colors with the same label
+    labels = np.unique(labels, return_inverse=True)[1].ravel()
+    totals = np.bincount(labels, weights=counts)
+    means = np.stack(
+        [
+            np.bincount(labels, weights=colors[:, channel] * counts) / totals
+            for channel in range(3)
+        ],
+        axis=1,
+    )
+    return [Color(*c) for c in np.rint(means).astype(int).tolist()]
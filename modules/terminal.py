@@ -135,3 +135,25 @@ def format_table(cells: list[list[Cell]], border_fore: Color = None) -> str:
     table += BOTTOM_RIGHT_ANGLE
 
     return table
+
+
+def format_palette(colors: list[Color]) -> str:
+    """Format a palette as a table with a bar, RGB, HSV and hex of each color.
+
+    Args:
+        colors (list[Color])
+
+    Returns:
+        str
+    """
+    cells = []
+    BAR_WIDTH = 16
+    for c in colors:
+        row = []
+        row.append(Cell("█" * BAR_WIDTH, fore=c))
+        row.append(Cell(c.rgb_formatted))
+        row.append(Cell(c.hsv_formatted))
+        row.append(Cell(c.hex))
+        cells.append(row)
+
+    return format_table(cells, border_fore=Color(211, 211, 211))
@@ -0,0 +1,314 @@
+"""Tiled extraction module.
+
+Each tile of an image is clustered on its own and summarized by the \
+    sufficient statistics of its clusters: number of pixels, sum of the \
+    coordinates and sum of the squared norms, in the color space they are \
+    clustered in. The statistics of different tiles can be merged without \
+    their pixels, and are plain lists and numbers, so they can be computed \
+    by other processes or machines and exchanged as JSON files.
+"""
+from __future__ import annotations
+
+import logging
+
+import numpy as np
+from PIL import Image
+
+from .color import Color
+from .colorspace import lab_to_rgb, rgb_to_lab
+from .kmeans import KMeans
+from .palette_size import nearest_labels
+from .pixels import color_histogram, read_pixels
+
+
+def tile_boxes(size: tuple[int, int], tile_size: int) -> list[tuple[int, ...]]:
+    """Split an image into square tiles, row by row.
+
+    Args:
+        size (tuple[int, int]): Width and height of the image.
+        tile_size (int): Side of the tiles, the last row and column \
+            can be smaller.
+
+    Returns:
+        list[tuple[int, ...]]: Left, upper, right and lower coordinates \
+            of each tile.
+    """
+    if tile_size < 1:
+        raise ValueError("The tile size must be at least 1")
+
+    width, height = size
+    return [
+        (left, upper, min(left + tile_size, width), min(upper + tile_size, height))
+        for upper in range(0, height, tile_size)
+        for left in range(0, width, tile_size)
+    ]
+
+
+def _to_space(rgb: np.ndarray, color_space: str) -> np.ndarray:
+    # coordinates of RGB colors in the clustering color space
+    if color_space == "lab":
+        return rgb_to_lab(rgb)
+    return np.asarray(rgb, dtype=np.float64)
+
+
+def _to_colors(points: np.ndarray, color_space: str) -> list[Color]:
+    # colors of points of the clustering color space, rounded to RGB
+    if color_space == "lab":
+        points = lab_to_rgb(points)
+    return [Color(*c) for c in np.clip(np.rint(points), 0, 255).astype(int).tolist()]
+
+
+def _sq_error(stats: dict, centroids: np.ndarray, labels: np.ndarray) -> float:
+    # sum of the squared distances between the pixels of the clusters and the
+    # centroids they are assigned to, expanded from the cluster statistics
+    counts = np.asarray(stats["counts"], dtype=np.float64)
+    sums = np.asarray(stats["sums"], dtype=np.float64).reshape(-1, 3)
+    assigned = centroids[labels]
+    sq_error = (
+        np.sum(stats["sq_sums"])
+        - 2 * (assigned * sums).sum()
+        + (counts * (assigned**2).sum(axis=1)).sum()
+    )
+    return max(float(sq_error), 0)
+
+
+def tile_statistics(
+    pixels: np.ndarray,
+    n_clusters: int,
+    centroids: list[Color] = None,
+    color_space: str = "rgb",
+    **kmeans_params,
+) -> dict:
+    """Cluster the pixels of a tile and get the statistics of the clusters.
+
+    Args:
+        pixels (np.ndarray): Nx3 array of uint8.
+        n_clusters (int): Number of clusters of the tile, \
+            fewer if the tile has fewer colors.
+        centroids (list[Color], optional): If provided, the pixels are \
+            assigned to the closest of these colors instead of being \
+            clustered, and the clusters follow their order. Defaults to None.
+        color_space (str, optional): "rgb" or "lab". Defaults to "rgb".
+        **kmeans_params: Other arguments of the KMeans model.
+
+    Returns:
+        dict: Number of pixels, counts, sums and sq_sums of each cluster, \
+            centroids if provided.
+    """
+    colors, counts = color_histogram(pixels)
+    points = _to_space(colors, color_space)
+
+    if centroids is None:
+        kmeans = KMeans(
+            n_clusters=min(n_clusters, len(colors)),
+            color_space=color_space,
+            **kmeans_params,
+        ).fit(colors, weights=counts)
+        labels = kmeans.labels
+        n_clusters = len(kmeans.centroids)
+    else:
+        labels = nearest_labels(
+            points, _to_space(np.array([c.rgb for c in centroids]), color_space)
+        )
+        n_clusters = len(centroids)
+
+    weights = counts.astype(np.float64)
+    cluster_counts = np.bincount(labels, weights=weights, minlength=n_clusters)
+    sums = np.stack(
+        [
+            np.bincount(labels, weights=weights * points[:, c], minlength=n_clusters)
+            for c in range(3)
+        ],
+        axis=1,
+    )
+    sq_sums = np.bincount(
+        labels, weights=weights * (points**2).sum(axis=1), minlength=n_clusters
+    )
+
+    if centroids is None:
+        # the clusters of different tiles are unrelated, empty ones are useless
+        filled = cluster_counts > 0
+        cluster_counts, sums, sq_sums = (
+            cluster_counts[filled],
+            sums[filled],
+            sq_sums[filled],
+        )
+
+    stats = {
+        "pixels": int(counts.sum()),
+        "counts": cluster_counts.astype(np.int64).tolist(),
+        "sums": sums.tolist(),
+        "sq_sums": sq_sums.tolist(),
+    }
+    if centroids is not None:
+        stats["centroids"] = [list(c.rgb) for c in centroids]
+    return stats
+
+
+def map_tiles(
+    image: Image.Image | str,
+    boxes: list[tuple[int, ...]],
+    n_clusters: int,
+    centroids: list[Color] = None,
+    color_space: str = "rgb",
+    **kmeans_params,
+) -> list[dict]:
+    """Get the statistics of some tiles of an image.
+
+    Args:
+        image (Image.Image | str): Image, or path to the image, \
+            decoded once for all the tiles.
+        boxes (list[tuple[int, ...]]): Tiles, as returned by tile_boxes.
+        n_clusters (int): Number of clusters of each tile.
+        centroids (list[Color], optional): Colors the pixels are assigned to. \
+            Defaults to None.
+        color_space (str, optional): "rgb" or "lab". Defaults to "rgb".
+        **kmeans_params: Other arguments of the KMeans model.
+
+    Returns:
+        list[dict]: Statistics of each tile, with its box.
+    """
+    if isinstance(image, str):
+        image = Image.open(image)
+
+    results = []
+    for box in boxes:
+        logging.info(f"Clustering tile {box}")
+        stats = tile_statistics(
+            read_pixels(image.crop(box)),
+            n_clusters,
+            centroids=centroids,
+            color_space=color_space,
+            **kmeans_params,
+        )
+        stats["box"] = list(box)
+        results.append(stats)
+    return results
+
+
+def _merge_clusters(stats: list[dict]) -> dict:
+    # statistics of the clusters of all the tiles, one after the other
+    return {
+        "counts": [n for s in stats for n in s["counts"]],
+        "sums": [x for s in stats for x in s["sums"]],
+        "sq_sums": [x for s in stats for x in s["sq_sums"]],
+    }
+
+
+def reduce_tiles(
+    stats: list[dict],
+    n_clusters: int,
+    color_space: str = "rgb",
+    **kmeans_params,
+) -> tuple[list[Color], float]:
+    """Merge the statistics of the tiles into the palette of the whole image.
+
+    If the tiles were clustered on their own, the means of their clusters \
+        are clustered with the KMeans algorithm, weighted by their number \
+        of pixels. If they were assigned to the same centroids, each \
+        centroid moves to the mean of its pixels in all the tiles, \
+        as in an iteration of the KMeans algorithm.
+
+    Args:
+        stats (list[dict]): Statistics of the tiles.
+        n_clusters (int): Number of colors of the palette.
+        color_space (str, optional): "rgb" or "lab". Defaults to "rgb".
+        **kmeans_params: Other arguments of the KMeans model.
+
+    Returns:
+        tuple[list[Color], float]: Colors and the sum of the squared distances \
+            between each pixel and the color its cluster is merged into, \
+            at least the inertia of the colors on the whole image.
+    """
+    if not stats:
+        raise ValueError("There are no tiles to merge")
+
+    if "centroids" in stats[0]:
+        previous = stats[0]["centroids"]
+        if any(s.get("centroids") != previous for s in stats):
+            raise ValueError("The tiles were assigned to different centroids")
+
+        counts = np.sum([s["counts"] for s in stats], axis=0).astype(np.float64)
+        sums = np.sum([s["sums"] for s in stats], axis=0)
+        sq_sums = np.sum([s["sq_sums"] for s in stats], axis=0)
+        # empty clusters keep their previous centroid
+        points = _to_space(np.array(previous, dtype=np.uint8), color_space)
+        filled = counts > 0
+        points[filled] = sums[filled] / counts[filled, None]
+        colors = _to_colors(points, color_space)
+        merged = {"counts": counts, "sums": sums, "sq_sums": sq_sums}
+        labels = np.arange(len(colors))
+    else:
+        if any("centroids" in s for s in stats):
+            raise ValueError("The tiles were assigned to different centroids")
+
+        merged = _merge_clusters(stats)
+        counts = np.array(merged["counts"], dtype=np.float64)
+        means = np.array(merged["sums"]).reshape(-1, 3) / counts[:, None]
+        # the KMeans model clusters RGB points, the means are converted back
+        rgb_means = lab_to_rgb(means) if color_space == "lab" else means
+        logging.info(f"Merging {len(counts)} clusters of {len(stats)} tiles")
+        # the means are much closer to the centroids than their pixels,
+        # so the merge runs until the centroids stop moving
+        kmeans = KMeans(
+            n_clusters=min(n_clusters, len(counts)),
+            color_space=color_space,
+            **{**kmeans_params, "min_dist": 0},
+        ).fit(rgb_means, weights=counts)
+        colors = kmeans.centroids
+        labels = kmeans.labels
+
+    centroids = _to_space(np.array([c.rgb for c in colors]), color_space)
+    return colors, _sq_error(merged, centroids, labels)
+
+
+def palette_inertia(
+    colors: np.ndarray,
+    counts: np.ndarray,
+    palette: list[Color],
+    color_space: str = "rgb",
+    chunk_size: int = 2**16,
+) -> float:
+    """Get the inertia of a palette on an histogram.
+
+    Args:
+        colors (np.ndarray): Nx3 array of uint8.
+        counts (np.ndarray): Number of pixels of each color.
+        palette (list[Color])
+        color_space (str, optional): "rgb" or "lab". Defaults to "rgb".
+        chunk_size (int, optional): Number of colors whose distances \
+            are computed at once. Defaults to 2**16.
+
+    Returns:
+        float: Sum of the squared distances between each pixel \
+            and the closest color of the palette.
+    """
+    centroids = _to_space(np.array([c.rgb for c in palette]), color_space)
+    inertia = 0.0
+    for start in range(0, len(colors), chunk_size):
+        points = _to_space(colors[start : start + chunk_size], color_space)
+        sq_dist = ((points[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+        inertia += float(
+            (sq_dist.min(axis=1) * counts[start : start + chunk_size]).sum()
+        )
+    return inertia
+
+
+def palette_deviation(
+    palette: list[Color], reference: list[Color], color_space: str = "rgb"
+) -> float:
+    """Get the largest distance between a color and the closest reference color.
+
+    Args:
+        palette (list[Color])
+        reference (list[Color])
+        color_space (str, optional): Space the distance is measured in, \
+            "rgb" or "lab". Defaults to "rgb".
+
+    Returns:
+        float
+    """
+    points = _to_space(np.array([c.rgb for c in palette]), color_space)
+    references = _to_space(np.array([c.rgb for c in reference]), color_space)
+    sq_dist = ((points[:, None, :] - references[None, :, :]) ** 2).sum(axis=2)
+    return float(np.sqrt(sq_dist.min(axis=1).max()))
@@ -0,0 +1,68 @@
+"""Extract a color palette through palette-daemon.py."""
+
+import argparse
+import base64
+import json
+import os
+import socket
+import sys
+
+from modules.color import Color
+from modules.terminal import format_palette
+
+DEFAULT_SOCKET = os.path.join(os.environ.get("TMPDIR", "/tmp"), "imagepalette.sock")
+
+
+def main():
+    """Run the main function."""
+    parser = argparse.ArgumentParser(
+        description="Extract the color palette of an image through palette-daemon.py. "
+        "All the arguments of imagepalette.py are accepted and sent to the daemon",
+    )
+    parser.add_argument("-i", "--input", help="Source image path")
+    parser.add_argument(
+        "--socket",
+        help=f"Path of the Unix socket of the daemon. Default: {DEFAULT_SOCKET}",
+        type=str,
+        default=DEFAULT_SOCKET,
+    )
+    parser.add_argument(
+        "--send-data",
+        help="Send the content of the image instead of its path, "
+        "if the daemon cannot read the file",
+        action="store_true",
+    )
+    args, arguments = parser.parse_known_args()
+
+    if not args.input:
+        parser.error("Specify the input image. Use -h to get a list of commands.")
+
+    request = {"args": arguments, "cwd": os.getcwd()}
+    if args.send_data:
+        with open(args.input, "rb") as f:
+            request["data"] = base64.b64encode(f.read()).decode()
+        request["name"] = os.path.basename(args.input)
+    else:
+        request["path"] = args.input
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(args.socket)
+        except OSError as e:
+            sys.exit(f"Cannot connect to the daemon on {args.socket}: {e}")
+
+        client.sendall((json.dumps(request) + "\n").encode())
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile("rb") as f:
+            response = json.loads(f.readline())
+
+    if not response["ok"]:
+        sys.exit(f"imagepalette: error: {response['error']}")
+
+    if "--print" in arguments:
+        palette = response["palette"].get("aggregate", response["palette"])
+        print(format_palette([Color(*c) for c in palette["rgb"]]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Extract color palettes for palette-client.py in long-running worker processes."""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable
+
+from imagepalette import checkArgs, createParser, processImage, setupLogging
+
+DEFAULT_SOCKET = os.path.join(os.environ.get("TMPDIR", "/tmp"), "imagepalette.sock")
+# relative paths of the requests without a working directory
+START_DIRECTORY = os.getcwd()
+# maximum size of a request, that can contain a whole image
+MAX_REQUEST_SIZE = 2**28
+
+
+class RequestParser(argparse.ArgumentParser):
+    """Parser of the arguments of a request, raising errors instead of exiting.
+
+    Nothing is printed either: the output of the workers can be the stream \
+        of the responses, so the help or any other message of an action \
+        is raised as an error and sent in the response.
+    """
+
+    def error(self, message: str):
+        """Raise an error.
+
+        Args:
+            message (str)
+
+        Raises:
+            ValueError
+        """
+        raise ValueError(message)
+
+    def exit(self, status: int = 0, message: str = None):
+        """Raise an error instead of exiting after an action such as --help.
+
+        Args:
+            status (int, optional): Ignored. Defaults to 0.
+            message (str, optional): Defaults to None.
+
+        Raises:
+            ValueError
+        """
+        raise ValueError(message or "The arguments stop the program")
+
+    def _print_message(self, message: str, file=None):
+        # used by print_help, print_usage and the version action
+        if message:
+            raise ValueError(message)
+
+
+def parseRequest(request: dict) -> argparse.Namespace:
+    """Get the arguments of a request.
+
+    The request contains the command line arguments of imagepalette.py \
+        in "args" and/or the same options by name in "options", \
+        for example {"colors": 8, "json": true}.
+
+    Args:
+        request (dict)
+
+    Returns:
+        argparse.Namespace
+    """
+    parser = createParser(parser_class=RequestParser)
+    args = parser.parse_args(request.get("args", []))
+    for key, value in request.get("options", {}).items():
+        key = key.replace("-", "_")
+        if not hasattr(args, key):
+            raise ValueError(f"Unknown option: {key}")
+        setattr(args, key, value)
+
+    # the palette is returned instead of being printed by the daemon
+    args.print = False
+    checkArgs(parser, args, require_output=False)
+    return args
+
+
+def runJob(request: dict) -> dict:
+    """Extract the palette of a request, run in a worker process.
+
+    The image is either a path in "path" (or in the input argument), relative \
+        to the working directory of the client in "cwd" (or of the daemon \
+        if not provided), or the base64 encoded \
+        content of the file in "data", named "name" in the output files.
+
+    Args:
+        request (dict)
+
+    Returns:
+        dict: The palette in the format of the JSON files.
+    """
+    args = parseRequest(request)
+    os.chdir(request.get("cwd", START_DIRECTORY))
+
+    with tempfile.TemporaryDirectory() as folder:
+        if "data" in request:
+            path = os.path.join(folder, os.path.basename(request.get("name", "image")))
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(request["data"]))
+        else:
+            path = request.get("path") or args.input
+
+        if not path:
+            raise ValueError("Specify the input image")
+
+        return processImage(args, path).paletteDict()
+
+
+class WorkerPool:
+    """Worker processes running the requests, replaced if one of them dies."""
+
+    def __init__(self, workers: int) -> WorkerPool:
+        """Initialize a WorkerPool object, starting the processes.
+
+        Args:
+            workers (int): Number of images processed in parallel.
+
+        Returns:
+            WorkerPool
+        """
+        self._workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    async def run(self, request: dict) -> dict:
+        """Run a request in a worker process.
+
+        If a worker is killed (for example by the kernel when out of memory) \
+            or crashes, the pool cannot run any more requests: it is replaced \
+            and the requests that were running in it fail.
+
+        Args:
+            request (dict)
+
+        Returns:
+            dict: The palette in the format of the JSON files.
+        """
+        executor = self._executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, runJob, request
+            )
+        except BrokenProcessPool:
+            # the concurrent requests of the broken pool only replace it once
+            if self._executor is executor:
+                logging.error("A worker process died, restarting the workers")
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+                executor.shutdown(wait=False)
+            raise
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        self._executor.shutdown()
+
+
+async def respond(
+    request_line: bytes,
+    pool: WorkerPool,
+    send: Callable[[dict], Awaitable[None]],
+):
+    """Run a request and send its response.
+
+    Args:
+        request_line (bytes): JSON encoded request.
+        pool (WorkerPool): Worker processes.
+        send (Callable[[dict], Awaitable[None]]): Coroutine sending the response.
+    """
+    request = {}
+    try:
+        request = json.loads(request_line)
+        palette = await pool.run(request)
+    except BrokenProcessPool:
+        response = {
+            "ok": False,
+            "error": "The worker process running the request died, "
+            "for example because it ran out of memory",
+        }
+    except asyncio.CancelledError:
+        raise
+    except BaseException as e:
+        # no request can stop the daemon, not even a SystemExit of a worker
+        logging.error(f"Request failed: {e!r}")
+        response = {"ok": False, "error": str(e)}
+    else:
+        response = {"ok": True, "palette": palette}
+
+    if isinstance(request, dict) and "id" in request:
+        response["id"] = request["id"]
+    await send(response)
+
+
+async def handleRequests(
+    reader: asyncio.StreamReader,
+    pool: WorkerPool,
+    send: Callable[[dict], Awaitable[None]],
+):
+    """Run the requests, one JSON document per line, until the end of the stream.
+
+    The requests run concurrently and their responses are sent as soon as they \
+        are ready, with the id of the request if it has one.
+
+    Args:
+        reader (asyncio.StreamReader)
+        pool (WorkerPool): Worker processes.
+        send (Callable[[dict], Awaitable[None]]): Coroutine sending a response.
+    """
+    tasks = set()
+    while line := await reader.readline():
+        if line.strip():
+            tasks.add(asyncio.create_task(respond(line, pool, send)))
+
+    await asyncio.gather(*tasks)
+
+
+async def serveSocket(path: str, pool: WorkerPool):
+    """Serve the requests received on a Unix socket.
+
+    Args:
+        path (str): Path of the socket.
+        pool (WorkerPool): Worker processes.
+    """
+
+    async def handleConnection(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        lock = asyncio.Lock()
+
+        async def send(response: dict):
+            # responses of concurrent requests must not interleave
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+
+        try:
+            await handleRequests(reader, pool, send)
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    server = await asyncio.start_unix_server(
+        handleConnection, path=path, limit=MAX_REQUEST_SIZE
+    )
+    print(f"Listening on {path}")
+
+    # stop on SIGINT and SIGTERM, removing the socket
+    stop = asyncio.get_running_loop().create_future()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(
+            signal_number, stop.set_result, None
+        )
+
+    try:
+        async with server:
+            await stop
+    finally:
+        os.remove(path)
+
+
+async def serveStdin(pool: WorkerPool):
+    """Serve the requests read from the standard input, answering on the output.
+
+    Args:
+        pool (WorkerPool): Worker processes.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_REQUEST_SIZE)
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+    )
+
+    async def send(response: dict):
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+    await handleRequests(reader, pool, send)
+
+
+def main():
+    """Run the main function."""
+    parser = argparse.ArgumentParser(
+        description="Keep worker processes ready to extract color palettes. "
+        "Each request is a JSON document on a single line, answered with "
+        "the palette in the format of the JSON files. "
+        "Use palette-client.py to send the arguments of imagepalette.py"
+    )
+    parser.add_argument(
+        "--socket",
+        help=f"Path of the Unix socket. Default: {DEFAULT_SOCKET}",
+        type=str,
+        default=DEFAULT_SOCKET,
+    )
+    parser.add_argument(
+        "--stdin",
+        help="Read the requests from the standard input and write the responses "
+        "to the standard output instead of using a socket",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of images processed in parallel. Default: number of cores",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument("--console", help="Log to console", action="store_true")
+    args = parser.parse_args()
+
+    if args.stdin and not args.console:
+        # the standard output only contains the responses
+        logging.basicConfig(
+            format="%(asctime)s - %(levelname)s - %(message)s",
+            level=logging.INFO,
+            filename=__file__.replace(".py", ".log"),
+            filemode="w+",
+        )
+    else:
+        setupLogging(args, __file__.replace(".py", ".log"))
+
+    pool = WorkerPool(args.workers)
+    try:
+        if args.stdin:
+            asyncio.run(serveStdin(pool))
+        else:
+            asyncio.run(serveSocket(args.socket, pool))
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
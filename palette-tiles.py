@@ -0,0 +1,264 @@
+"""Extract the color palette of a very large image on several machines.
+
+Each machine clusters a shard of the tiles of the image and saves the \
+    statistics of their clusters in a JSON file, that are then merged into \
+    the palette. Clustering the tiles again with the merged palette and \
+    merging the new files refines it.
+
+    python3 palette-tiles.py map image.tif --shard 0/4 -o stats-0.json
+    python3 palette-tiles.py reduce stats-*.json -o palette.json
+    python3 palette-tiles.py map image.tif --shard 0/4 --palette palette.json \
+        -o refined-0.json
+    python3 palette-tiles.py reduce refined-*.json -o palette.json
+"""
+
+import argparse
+import json
+import logging
+
+from PIL import Image
+
+from imagepalette import setupLogging
+from modules.color import Color
+from modules.colorspace import scale_distance
+from modules.tiles import map_tiles, reduce_tiles, tile_boxes
+
+
+def addClusteringArguments(parser: argparse.ArgumentParser):
+    """Add the arguments of the KMeans model.
+
+    Args:
+        parser (argparse.ArgumentParser)
+    """
+    parser.add_argument(
+        "-c", "--colors", help="Number of extracted colors", type=int, default=5
+    )
+    parser.add_argument(
+        "--seed", help="Seed of the KMeans algorithm", type=int, default=None
+    )
+    parser.add_argument(
+        "--min-color-distance",
+        help="Minimum average distance between the pixels and their color, "
+        "in RGB units (converted with --color-space lab). Default: 35",
+        type=float,
+        default=35,
+    )
+    parser.add_argument(
+        "--max-iterations",
+        help="Maximum number of iterations without change. Default: 10",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--engine",
+        help="Implementation of the KMeans algorithm. Default: numpy",
+        choices=["numpy", "hamerly"],
+        default="numpy",
+    )
+    parser.add_argument(
+        "--init",
+        help="Initialization of the KMeans centroids. Default: random",
+        choices=["random", "k-means++", "k-means||"],
+        default="random",
+    )
+    parser.add_argument("--console", help="Log to console", action="store_true")
+
+
+def kmeansParams(args: argparse.Namespace, color_space: str) -> dict:
+    """Get the arguments of the KMeans model.
+
+    Args:
+        args (argparse.Namespace)
+        color_space (str): Color space the pixels are clustered in.
+
+    Returns:
+        dict
+    """
+    return {
+        "random_seed": args.seed,
+        "min_dist": scale_distance(args.min_color_distance, color_space),
+        "max_iterations": args.max_iterations,
+        "engine": args.engine,
+        "init": args.init,
+    }
+
+
+def readPalette(path: str) -> list[Color]:
+    """Read the colors of a palette JSON file.
+
+    Args:
+        path (str)
+
+    Returns:
+        list[Color]
+    """
+    with open(path) as f:
+        return [Color(*c) for c in json.load(f)["rgb"]]
+
+
+def mapCommand(args: argparse.Namespace, parser: argparse.ArgumentParser):
+    """Cluster a shard of the tiles and save their statistics.
+
+    Args:
+        args (argparse.Namespace)
+        parser (argparse.ArgumentParser)
+    """
+    try:
+        index, count = (int(n) for n in args.shard.split("/"))
+    except ValueError:
+        parser.error("The shard must be INDEX/COUNT, for example 0/4")
+    if not 0 <= index < count:
+        parser.error("The shard index must be in range 0 to COUNT - 1")
+
+    image = Image.open(args.image)
+    boxes = tile_boxes(image.size, args.tile_size)[index::count]
+    centroids = readPalette(args.palette) if args.palette else None
+    logging.info(f"Clustering {len(boxes)} tiles of {args.image}")
+
+    stats = map_tiles(
+        image,
+        boxes,
+        args.tile_colors or 2 * args.colors,
+        centroids=centroids,
+        color_space=args.color_space,
+        **kmeansParams(args, args.color_space),
+    )
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "image": args.image,
+                "size": list(image.size),
+                "tile_size": args.tile_size,
+                "color_space": args.color_space,
+                "tiles": stats,
+            },
+            f,
+        )
+    logging.info(f"Statistics saved. Path: {args.output}")
+
+
+def reduceCommand(args: argparse.Namespace, parser: argparse.ArgumentParser):
+    """Merge the statistics of the shards into a palette JSON file.
+
+    Args:
+        args (argparse.Namespace)
+        parser (argparse.ArgumentParser)
+    """
+    shards = []
+    for path in args.stats:
+        with open(path) as f:
+            shards.append(json.load(f))
+
+    for key in ("size", "tile_size", "color_space"):
+        if any(shard[key] != shards[0][key] for shard in shards):
+            parser.error(f"The files have a different {key.replace('_', ' ')}")
+
+    # in the order of the tiles, so that any sharding gives the same palette
+    stats = sorted(
+        (tile for shard in shards for tile in shard["tiles"]),
+        key=lambda tile: (tile["box"][1], tile["box"][0]),
+    )
+    boxes = [tuple(tile["box"]) for tile in stats]
+    expected = tile_boxes(shards[0]["size"], shards[0]["tile_size"])
+    if len(set(boxes)) != len(boxes):
+        parser.error("Some tiles are in more than one file")
+    if len(boxes) != len(expected):
+        # the palette is still extracted from the available tiles
+        logging.warning(f"Only {len(boxes)} of the {len(expected)} tiles are merged")
+
+    color_space = shards[0]["color_space"]
+    colors, inertia = reduce_tiles(
+        stats, args.colors, color_space=color_space, **kmeansParams(args, color_space)
+    )
+    pixels = sum(tile["pixels"] for tile in stats)
+    logging.info(
+        f"Merged {len(stats)} tiles, average distance {(inertia / pixels) ** 0.5:.3f}"
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "rgb": [c.rgb for c in colors],
+                "hsv": [c.hsv for c in colors],
+                "hex": [c.hex for c in colors],
+                "tiles": {
+                    "tiles": len(stats),
+                    "tile_size": shards[0]["tile_size"],
+                    "inertia": inertia,
+                },
+            },
+            f,
+            indent=2,
+        )
+    logging.info(f"JSON file saved. Path: {args.output}")
+
+
+def main():
+    """Run the main function."""
+    parser = argparse.ArgumentParser(
+        description="Extract the color palette of a very large image by clustering "
+        "its tiles on several machines and merging their clusters"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    map_parser = subparsers.add_parser(
+        "map", help="Cluster a shard of the tiles and save the statistics"
+    )
+    map_parser.add_argument("image", help="Source image path")
+    map_parser.add_argument(
+        "-o", "--output", help="Statistics JSON file", required=True
+    )
+    map_parser.add_argument(
+        "--shard",
+        help="Shard of the tiles clustered by this machine, as INDEX/COUNT. "
+        "Default: 0/1",
+        type=str,
+        default="0/1",
+    )
+    map_parser.add_argument(
+        "--tile-size",
+        help="Side of the tiles, in pixels. Default: 512",
+        type=int,
+        default=512,
+    )
+    map_parser.add_argument(
+        "--tile-colors",
+        help="Number of clusters of each tile. Default: twice --colors",
+        type=int,
+        default=None,
+    )
+    map_parser.add_argument(
+        "--palette",
+        help="Palette JSON file the pixels are assigned to instead of clustering "
+        "the tiles, to refine a merged palette",
+        type=str,
+        default=None,
+    )
+    map_parser.add_argument(
+        "--color-space",
+        help="Color space the pixels are clustered in. Default: rgb",
+        choices=["rgb", "lab"],
+        default="rgb",
+    )
+    addClusteringArguments(map_parser)
+
+    reduce_parser = subparsers.add_parser(
+        "reduce", help="Merge the statistics into a palette JSON file"
+    )
+    reduce_parser.add_argument("stats", help="Statistics JSON files", nargs="+")
+    reduce_parser.add_argument(
+        "-o", "--output", help="Palette JSON file", required=True
+    )
+    addClusteringArguments(reduce_parser)
+
+    args = parser.parse_args()
+    setupLogging(args, __file__.replace(".py", ".log"))
+
+    if args.command == "map":
+        mapCommand(args, map_parser)
+    else:
+        reduceCommand(args, reduce_parser)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Tests of the clustering in the CIELAB color space."""
+import json
+import os
+
+from imagepalette import createParser, processImage
+from modules.colorspace import LAB_DISTANCE_SCALE, scale_distance
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE = os.path.join(ROOT, "output", "starry-night.jpg")
+
+
+def test_scale_distance():
+    assert scale_distance(35, "rgb") == 35
+    assert scale_distance(35, "lab") == 35 * LAB_DISTANCE_SCALE
+
+
+def test_lab_fit_runs_more_than_one_iteration(tmp_path):
+    metrics = tmp_path / "metrics.jsonl"
+    args = createParser().parse_args(
+        [
+            "-i",
+            IMAGE,
+            "--json",
+            "--resize",
+            "--seed",
+            "1",
+            "--color-space",
+            "lab",
+            "-o",
+            str(tmp_path),
+            "--metrics",
+            str(metrics),
+        ]
+    )
+    processImage(args, IMAGE)
+
+    with open(metrics) as f:
+        record = json.loads(f.readline())
+    assert record["iterations"] > 1
@@ -0,0 +1,69 @@
+"""Tests of the requests of palette-daemon.py."""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+spec = importlib.util.spec_from_file_location(
+    "palette_daemon", os.path.join(ROOT, "palette-daemon.py")
+)
+palette_daemon = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(palette_daemon)
+
+
+class ExitingPool:
+    """Pool whose requests exit the worker, as argparse does on --help."""
+
+    async def run(self, request: dict) -> dict:
+        raise SystemExit(0)
+
+
+def test_help_request_raises_value_error(capsys):
+    with pytest.raises(ValueError, match="usage"):
+        palette_daemon.parseRequest({"args": ["-h"]})
+    assert capsys.readouterr().out == ""
+
+
+def test_version_action_raises_value_error(capsys):
+    parser = palette_daemon.RequestParser()
+    parser.add_argument("--version", action="version", version="1.0")
+    with pytest.raises(ValueError, match="1.0"):
+        parser.parse_args(["--version"])
+    assert capsys.readouterr().out == ""
+
+
+def test_respond_answers_system_exit():
+    responses = []
+
+    async def send(response: dict):
+        responses.append(response)
+
+    asyncio.run(palette_daemon.respond(b'{"id": 3}', ExitingPool(), send))
+    assert responses == [{"ok": False, "error": "0", "id": 3}]
+
+
+def test_stdin_daemon_survives_help():
+    requests = [
+        {"args": ["-h"], "id": 1},
+        {"args": ["--colors", "3"], "id": 2},
+    ]
+    result = subprocess.run(
+        [sys.executable, "palette-daemon.py", "--stdin", "-w", "1"],
+        input="".join(json.dumps(r) + "\n" for r in requests),
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        timeout=60,
+    )
+    responses = {r["id"]: r for r in map(json.loads, result.stdout.splitlines())}
+    assert sorted(responses) == [1, 2]
+    assert not responses[1]["ok"] and "usage" in responses[1]["error"]
+    # the second request has no image, but is still answered
+    assert not responses[2]["ok"]